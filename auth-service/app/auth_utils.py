@@ -1,18 +1,34 @@
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import os
 
 SECRET_KEY = "your-secret-key-for-development-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 часа
 
+# Стоимость bcrypt (2^rounds итераций); подбирается под железо командой
+# python -m app.hashing calibrate. Хэши с другой стоимостью needs_update считает
+# устаревшими, и /login пересчитывает их при следующем успешном входе
+BCRYPT_ROUNDS = int(os.getenv("AUTH_BCRYPT_ROUNDS", "12"))
+
 # Используем bcrypt без автоматического усечения
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Проверяет пароль; второй элемент - новый хэш, если у сохраненного устаревшая стоимость"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
     # Усекаем пароль до 72 байт вручную
     if len(password.encode('utf-8')) > 72:
@@ -0,0 +1,113 @@
+"""
+Пул соединений с базой: настройки из окружения и метрики для /metrics.
+
+    AUTH_DB_POOL_SIZE       постоянных соединений в пуле (0 - без пула, NullPool)
+    AUTH_DB_MAX_OVERFLOW    сколько соединений можно открыть сверх POOL_SIZE
+    AUTH_DB_POOL_TIMEOUT    сколько секунд ждать свободного соединения
+    AUTH_DB_POOL_RECYCLE    через сколько секунд переоткрывать соединение (-1 - никогда)
+    AUTH_DB_POOL_PRE_PING   проверять соединение перед выдачей (1/0)
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
+
+ENV_PREFIX = "AUTH_DB_"
+
+
+class PoolStats:
+    """Счетчики выдачи соединений из пула"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, timed_out: bool):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.timeouts,
+                "checkout_wait_avg_ms": (
+                    round(self.wait_total / attempts * 1000, 3) if attempts else 0.0
+                ),
+                "checkout_wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+class _MeteredPoolMixin:
+    """Замеряет ожидание свободного соединения (включая открытие нового) и таймауты"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - started, timed_out=False)
+        return connection
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """Аргументы create_engine/create_async_engine с настройками пула из окружения"""
+    if url.startswith("sqlite") and (is_async or ":memory:" in url):
+        # Для базы в памяти и для aiosqlite (поток на соединение) SQLAlchemy выбирает свой пул
+        return {}
+    pool_size = int(os.getenv(ENV_PREFIX + "POOL_SIZE", "5"))
+    options = {"pool_pre_ping": os.getenv(ENV_PREFIX + "POOL_PRE_PING", "1") == "1"}
+    if pool_size == 0:
+        options["poolclass"] = NullPool
+        return options
+    options.update(
+        poolclass=MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+        pool_size=pool_size,
+        max_overflow=int(os.getenv(ENV_PREFIX + "MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv(ENV_PREFIX + "POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv(ENV_PREFIX + "POOL_RECYCLE", "1800")),
+    )
+    return options
+
+
+def pool_snapshot(pool) -> dict:
+    """Текущее состояние пула и накопленные счетчики"""
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    snapshot = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        snapshot.update(stats.as_dict())
+    return snapshot
@@ -0,0 +1,203 @@
+"""
+Отдельный пул процессов для bcrypt (хэширование и проверка паролей).
+
+bcrypt намеренно медленный; в общем threadpool Starlette волна логинов занимает
+все потоки, и ждут даже /health и /users/me. Здесь пароли обрабатывают
+AUTH_HASH_WORKERS процессов, а в очереди к ним стоит не больше AUTH_HASH_QUEUE_LIMIT
+задач. Сверх этого запрос сразу получает 503 с Retry-After вместо ожидания.
+
+    AUTH_HASH_WORKERS      процессов bcrypt (по умолчанию - число CPU)
+    AUTH_HASH_QUEUE_LIMIT  сколько задач может ждать свободного процесса
+    AUTH_BULK_HASH_WORKERS сколько процессов может занять массовый импорт
+                           (по умолчанию - все, кроме одного)
+
+Стоимость bcrypt (AUTH_BCRYPT_ROUNDS) подбирается на целевой машине:
+
+    python -m app.hashing calibrate [целевые_мс]
+"""
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from . import auth_utils
+
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("AUTH_HASH_QUEUE_LIMIT", "64"))
+RETRY_AFTER_SECONDS = 1
+BULK_HASH_WORKERS = int(os.getenv("AUTH_BULK_HASH_WORKERS", str(max(HASH_WORKERS - 1, 1))))
+# Целевое время одного хэша для calibrate, мс
+CALIBRATION_TARGET_MS = 250
+# Границы стоимости, поддерживаемые bcrypt
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+
+class PoolBusy(Exception):
+    """Очередь к пулу bcrypt заполнена"""
+
+class HashPool:
+    """Ограниченный пул процессов; задачи сверх workers + queue_limit отклоняются"""
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: дочерний процесс не наследует потоки и соединения сервиса
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        """Убирает сломанный пул; следующая задача создаст новый"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """Запускает процессы заранее, чтобы первые логины не ждали их старта"""
+        executor = self._get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _acquire(self, count: int = 1):
+        with self._lock:
+            if self.in_flight + count > self.workers + self.queue_limit:
+                self.rejected += 1
+                raise PoolBusy()
+            self.in_flight += count
+
+    def _release(self, count: int = 1):
+        with self._lock:
+            self.in_flight -= count
+            self.completed += count
+
+    async def run(self, function, *args):
+        """Выполняет function(*args) в пуле; PoolBusy, если очередь заполнена.
+
+        Если процесс пула упал (OOM killer, kill), ProcessPoolExecutor больше не
+        принимает задачи: пул пересоздается, и задача повторяется один раз.
+        """
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(executor, function, *args)
+            except BrokenProcessPool:
+                self._discard(executor)
+                return await loop.run_in_executor(self._get_executor(), function, *args)
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self.in_flight,
+                "queued": max(self.in_flight - self.workers, 0),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "restarts": self.restarts,
+            }
+
+hash_pool = HashPool()
+
+async def hash_password(password: str) -> str:
+    return await hash_pool.run(auth_utils.get_password_hash, password)
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """Хэши паролей в исходном порядке.
+
+    Каждый пароль - отдельная задача пула, и в работе их не больше BULK_HASH_WORKERS:
+    логин, пришедший во время импорта, ждет в очереди не дольше одного хэша на процесс,
+    а каждый хэш учитывается в AUTH_HASH_QUEUE_LIMIT.
+    """
+    result: List[Optional[str]] = [None] * len(passwords)
+    indexes = iter(range(len(passwords)))
+
+    async def worker():
+        for index in indexes:
+            result[index] = await hash_pool.run(auth_utils.get_password_hash, passwords[index])
+
+    concurrency = max(1, min(BULK_HASH_WORKERS, hash_pool.workers, len(passwords)))
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        # PoolBusy или отмена запроса: оставшиеся пароли в пул не отправляются
+        for task in workers:
+            task.cancel()
+        raise
+    return result
+
+async def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Проверка пароля при логине: (верен ли, новый хэш или None, если стоимость не изменилась)"""
+    return await hash_pool.run(auth_utils.verify_and_update, password, hashed_password)
+
+def measure_rounds(rounds: int, samples: int = 3) -> float:
+    """Медиана времени одного хэша с данной стоимостью, мс"""
+    handler = auth_utils.pwd_context.handler("bcrypt").using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash("calibration-password")
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def calibrate(target_ms: float = CALIBRATION_TARGET_MS) -> Tuple[int, List[Tuple[int, float]]]:
+    """Наибольшая стоимость, при которой хэш укладывается в target_ms на этой машине.
+
+    Каждый шаг вдвое дороже предыдущего, поэтому перебор останавливается на
+    первой стоимости сверх цели. Возвращает (rounds, [(rounds, мс), ...]).
+    """
+    chosen = MIN_ROUNDS
+    measured = []
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        elapsed = measure_rounds(rounds)
+        measured.append((rounds, elapsed))
+        if elapsed > target_ms:
+            break
+        chosen = rounds
+    return chosen, measured
+
+def main(argv: List[str]) -> int:
+    command = argv[0] if argv else "calibrate"
+    if command == "calibrate":
+        target_ms = float(argv[1]) if len(argv) > 1 else CALIBRATION_TARGET_MS
+        chosen, measured = calibrate(target_ms)
+        for rounds, elapsed in measured:
+            print(f"rounds {rounds:>2}: {elapsed:8.1f} мс")
+        print(f"Сейчас AUTH_BCRYPT_ROUNDS={auth_utils.BCRYPT_ROUNDS}, "
+              f"для {target_ms:.0f} мс на хэш:")
+        print(f"AUTH_BCRYPT_ROUNDS={chosen}")
+        return 0
+    print("Использование: python -m app.hashing calibrate [целевые_мс]")
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
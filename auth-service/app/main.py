@@ -3,22 +3,41 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from typing import List
 import os
 
-from . import models, schemas, auth_utils
-from .database import get_db, engine
-from .models import Base
+from . import models, schemas, auth_utils, hashing
+from .user_cache import user_cache
+from .database import get_db, init_db, pool_metrics
 
-# Создаем таблицы при старте
-Base.metadata.create_all(bind=engine)
+# Применяем миграции при старте
+init_db()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(hashing.hash_pool.start)
+    yield
+    await run_in_threadpool(hashing.hash_pool.shutdown)
 
 app = FastAPI(
     title="Auth Service",
     description="Сервис аутентификации и управления пользователями",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+@app.exception_handler(hashing.PoolBusy)
+async def hash_pool_busy(request: Request, exc: hashing.PoolBusy):
+    """Очередь к bcrypt заполнена: клиент повторит запрос, а не будет ждать"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Сервис перегружен, повторите запрос позже"},
+        headers={"Retry-After": str(hashing.RETRY_AFTER_SECONDS)},
+    )
+
 # CORS middleware - используем встроенный CORSMiddleware
 app.add_middleware(
     CORSMiddleware,
@@ -43,12 +62,18 @@ def get_current_user(
         )
     
     user_id = payload.get("user_id")
+    # Обычно пользователь уже в кэше, и сессия так и не берет соединение из пула
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    generation = user_cache.generation
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
+    user_cache.put(user, generation)
     return user
 
 def require_admin(current_user: models.User = Depends(get_current_user)):
@@ -56,16 +81,28 @@ def require_admin(current_user: models.User = Depends(get_current_user)):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin rights required")
     return current_user
 
+# Обработчики с bcrypt асинхронные: запросы к базе идут в threadpool,
+# а хэширование - в пул процессов app/hashing.py, не занимая потоки
+
+def _find_user_by_email(db: Session, email: str):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def _save_user(db: Session, user: models.User) -> models.User:
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
 @app.post("/register", response_model=schemas.UserResponse)
-def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(models.User).filter(models.User.email == user_data.email).first()
+async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+    existing_user = await run_in_threadpool(_find_user_by_email, db, user_data.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    hashed_password = auth_utils.get_password_hash(user_data.password)
+    hashed_password = await hashing.hash_password(user_data.password)
     db_user = models.User(
         email=user_data.email,
         hashed_password=hashed_password,
@@ -73,19 +110,25 @@ def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
         branch_id=user_data.branch_id
     )
     
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await run_in_threadpool(_save_user, db, db_user)
 
 @app.post("/login", response_model=schemas.Token)
-def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == user_data.email).first()
-    if not user or not auth_utils.verify_password(user_data.password, user.hashed_password):
+async def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_user_by_email, db, user_data.email)
+    verified, new_hash = (False, None)
+    if user:
+        verified, new_hash = await hashing.verify_and_update(
+            user_data.password, user.hashed_password
+        )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
+    if new_hash is not None:
+        # Хэш со старой стоимостью bcrypt: сохраняем пересчитанный с AUTH_BCRYPT_ROUNDS
+        user.hashed_password = new_hash
+        await run_in_threadpool(db.commit)
     
     access_token = auth_utils.create_access_token(
         data={"user_id": user.id, "email": user.email}
@@ -102,24 +145,82 @@ def list_users(_admin: models.User = Depends(require_admin), db: Session = Depen
     return db.query(models.User).all()
 
 @app.post("/users", response_model=schemas.UserResponse)
-def create_user(user_data: schemas.UserCreate, _admin: models.User = Depends(require_admin), db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.email == user_data.email).first()
+async def create_user(user_data: schemas.UserCreate, _admin: models.User = Depends(require_admin),
+                      db: Session = Depends(get_db)):
+    existing = await run_in_threadpool(_find_user_by_email, db, user_data.email)
     if existing:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already exists")
-    hashed_password = auth_utils.get_password_hash(user_data.password)
+    hashed_password = await hashing.hash_password(user_data.password)
     user = models.User(
         email=user_data.email,
         hashed_password=hashed_password,
         role=user_data.role,
         branch_id=user_data.branch_id,
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    return await run_in_threadpool(_save_user, db, user)
 
-@app.put("/users/{user_id}", response_model=schemas.UserResponse)
-def update_user(user_id: int, update: schemas.UserUpdate, _admin: models.User = Depends(require_admin), db: Session = Depends(get_db)):
+def _existing_emails(db: Session, emails: List[str]) -> set:
+    """Уже занятые email одним запросом"""
+    rows = db.query(models.User.email).filter(models.User.email.in_(emails)).all()
+    return {email for (email,) in rows}
+
+def _save_users(db: Session, users: List[models.User]) -> List[int]:
+    """Вставляет всех пользователей в одной транзакции и возвращает их id"""
+    db.add_all(users)
+    try:
+        db.flush()
+        ids = [user.id for user in users]
+        db.commit()
+    except IntegrityError:
+        # Email заняли параллельно между проверкой и вставкой
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Email already exists, retry the import"
+        )
+    return ids
+
+@app.post("/users/bulk", response_model=schemas.UserBulkResponse)
+async def create_users_bulk(payload: schemas.UserBulkCreate,
+                            _admin: models.User = Depends(require_admin),
+                            db: Session = Depends(get_db)):
+    """Импорт пачки пользователей: занятые email пропускаются, остальные вставляются вместе"""
+    existing = await run_in_threadpool(_existing_emails, db, [user.email for user in payload.users])
+    results = []
+    pending = []
+    seen = set()
+    for user_data in payload.users:
+        if user_data.email in existing:
+            results.append(schemas.UserBulkResult(
+                email=user_data.email, status="exists", detail="Email already exists"
+            ))
+        elif user_data.email in seen:
+            results.append(schemas.UserBulkResult(
+                email=user_data.email, status="duplicate", detail="Email repeated in request"
+            ))
+        else:
+            seen.add(user_data.email)
+            result = schemas.UserBulkResult(email=user_data.email, status="created")
+            results.append(result)
+            pending.append((user_data, result))
+
+    hashed_passwords = await hashing.hash_passwords(
+        [user_data.password for user_data, _ in pending]
+    )
+    users = [
+        models.User(email=user_data.email, hashed_password=hashed_password,
+                    role=user_data.role, branch_id=user_data.branch_id)
+        for (user_data, _), hashed_password in zip(pending, hashed_passwords)
+    ]
+    if users:
+        ids = await run_in_threadpool(_save_users, db, users)
+        for (_, result), user_id in zip(pending, ids):
+            result.id = user_id
+    return schemas.UserBulkResponse(
+        created=len(users), skipped=len(results) - len(users), results=results
+    )
+
+def _apply_user_update(db: Session, user_id: int, update: schemas.UserUpdate,
+                       hashed_password: str = None):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -127,16 +228,25 @@ def update_user(user_id: int, update: schemas.UserUpdate, _admin: models.User =
         if db.query(models.User).filter(models.User.email == update.email, models.User.id != user_id).first():
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already in use")
         user.email = update.email
-    if update.password is not None:
-        user.hashed_password = auth_utils.get_password_hash(update.password)
+    if hashed_password is not None:
+        user.hashed_password = hashed_password
     if update.role is not None:
         user.role = update.role
     if update.branch_id is not None:
         user.branch_id = update.branch_id
     db.commit()
+    user_cache.invalidate(user_id)
     db.refresh(user)
     return user
 
+@app.put("/users/{user_id}", response_model=schemas.UserResponse)
+async def update_user(user_id: int, update: schemas.UserUpdate,
+                      _admin: models.User = Depends(require_admin), db: Session = Depends(get_db)):
+    hashed_password = None
+    if update.password is not None:
+        hashed_password = await hashing.hash_password(update.password)
+    return await run_in_threadpool(_apply_user_update, db, user_id, update, hashed_password)
+
 @app.delete("/users/{user_id}")
 def delete_user(user_id: int, _admin: models.User = Depends(require_admin), db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -144,12 +254,23 @@ def delete_user(user_id: int, _admin: models.User = Depends(require_admin), db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     db.delete(user)
     db.commit()
+    user_cache.invalidate(user_id)
     return {"status": "deleted"}
 
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "service": "auth-service", "database": "PostgreSQL"}
 
+@app.get("/metrics")
+def metrics():
+    """Метрики пула соединений для подбора POOL_SIZE / MAX_OVERFLOW, кэша пользователей
+    и пула bcrypt"""
+    return {
+        "db_pool": pool_metrics(),
+        "user_cache": user_cache.stats(),
+        "hash_pool": hashing.hash_pool.stats(),
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
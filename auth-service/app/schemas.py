@@ -1,5 +1,8 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
+
+# Сколько пользователей принимает один POST /users/bulk
+BULK_MAX_USERS = 1000
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -22,6 +25,20 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class UserBulkCreate(BaseModel):
+    users: List[UserCreate] = Field(..., min_length=1, max_length=BULK_MAX_USERS)
+
+class UserBulkResult(BaseModel):
+    email: str
+    status: str  # created | exists | duplicate
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class UserBulkResponse(BaseModel):
+    created: int
+    skipped: int
+    results: List[UserBulkResult]
+
 class UserLogin(BaseModel):
     email: str
     password: str
@@ -0,0 +1,86 @@
+"""
+Кэш пользователей для get_current_user: запрос с токеном не ходит в базу,
+пока запись пользователя свежая.
+
+    AUTH_USER_CACHE_SIZE         сколько пользователей хранить (0 - без кэша)
+    AUTH_USER_CACHE_TTL_SECONDS  сколько секунд запись считается свежей
+
+update_user и delete_user сбрасывают запись сразу; на других репликах
+сервиса изменение становится видно не позже чем через TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from . import models
+
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60"))
+# Хэш пароля в кэш не попадает: он не нужен для проверки токена
+CACHED_COLUMNS = ("id", "email", "role", "branch_id", "created_at")
+
+class UserCache:
+    """LRU снимков колонок пользователя по id с TTL.
+
+    get возвращает новый объект User вне сессии, поэтому изменения вызывающего
+    не попадают ни в кэш, ни в базу. Снимок, прочитанный до invalidate, не
+    кладется в кэш: put сравнивает поколение, взятое до чтения из базы.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int) -> Optional[models.User]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                snapshot, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return models.User(**snapshot)
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user: models.User, generation: int):
+        """Запоминает пользователя, прочитанного из базы после взятия generation"""
+        if self.max_size <= 0:
+            return
+        snapshot = {column: getattr(user, column) for column in CACHED_COLUMNS}
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[user.id] = (snapshot, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+user_cache = UserCache()
@@ -0,0 +1,133 @@
+"""
+Волна логинов против дешевых эндпоинтов: задержка /health и /users/me, пока
+идут параллельные POST /login.
+
+Запустите две копии сервиса на одной базе: текущую (bcrypt в пуле процессов
+app/hashing.py) и сборку до этого изменения (bcrypt в общем threadpool), затем:
+
+    python benchmarks/bench_login_storm.py \
+        --target pool=http://localhost:8000 --target threaded=http://localhost:8010
+
+Логины идут от --storm параллельных клиентов, а один клиент все это время по очереди
+запрашивает /health и /users/me и замеряет их задержку.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.auth_utils import create_access_token
+
+STORM_LEVELS = (50, 200)
+EMAIL = "bench_login_storm@example.com"
+PASSWORD = "bench-password"
+# Дольше этого дешевый запрос считается зависшим
+PROBE_TIMEOUT_SECONDS = 10
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def prepare_user(client):
+    """Пользователь для логинов и токен для /users/me"""
+    await client.post("/register", json={
+        "email": EMAIL, "password": PASSWORD, "role": "accountant", "branch_id": 1
+    })
+    response = await client.post("/login", json={"email": EMAIL, "password": PASSWORD})
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    me = await client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    return {"Authorization": f"Bearer {create_access_token({'user_id': me.json()['id']})}"}
+
+
+async def run_level(base_url, storm, duration):
+    """storm клиентов логинятся duration секунд; параллельно замеряются дешевые запросы"""
+    limits = httpx.Limits(max_connections=storm + 1, max_keepalive_connections=storm + 1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        headers = await prepare_user(client)
+        logins = Counter()
+        login_latencies = []
+        probe_latencies = []
+        probe_failures = 0
+        deadline = time.perf_counter() + duration
+
+        async def login_worker():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(
+                        "/login", json={"email": EMAIL, "password": PASSWORD}
+                    )
+                    logins[response.status_code] += 1
+                    if response.status_code == 200:
+                        login_latencies.append(time.perf_counter() - started)
+                    elif response.status_code == 503:
+                        await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+                except httpx.HTTPError:
+                    logins["error"] += 1
+
+        async def probe():
+            nonlocal probe_failures
+            paths = ("/health", "/users/me")
+            index = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    await client.get(
+                        paths[index % 2], headers=headers, timeout=PROBE_TIMEOUT_SECONDS
+                    )
+                except httpx.HTTPError:
+                    probe_failures += 1
+                probe_latencies.append(time.perf_counter() - started)
+                index += 1
+                await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        await asyncio.gather(probe(), *(login_worker() for _ in range(storm)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "logins_per_sec": logins[200] / elapsed,
+        "login_p99_ms": percentile(login_latencies, 0.99) * 1000,
+        "rejected_503": logins[503],
+        "errors": logins["error"],
+        "probe_p50_ms": percentile(probe_latencies, 0.50) * 1000,
+        "probe_p99_ms": percentile(probe_latencies, 0.99) * 1000,
+        "probe_max_ms": max(probe_latencies, default=float("nan")) * 1000,
+        "probe_timeouts": probe_failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--target", action="append", required=True, help="имя=URL сервиса")
+    parser.add_argument("--storm", action="append", type=int, help="число параллельных логинов")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на уровень")
+    args = parser.parse_args()
+
+    targets = [target.split("=", 1) for target in args.target]
+    print(f"{'сервис':<10} {'логинов':>8} {'логин/с':>8} {'p99 логина':>11} {'503':>6} "
+          f"{'probe p50':>10} {'probe p99':>10} {'probe max':>10} {'таймауты':>9}")
+    for storm in args.storm or STORM_LEVELS:
+        for name, url in targets:
+            result = asyncio.run(run_level(url, storm, args.duration))
+            print(f"{name:<10} {storm:>8} {result['logins_per_sec']:>8.1f} "
+                  f"{result['login_p99_ms']:>9.0f}ms {result['rejected_503']:>6} "
+                  f"{result['probe_p50_ms']:>8.1f}ms {result['probe_p99_ms']:>8.1f}ms "
+                  f"{result['probe_max_ms']:>8.1f}ms {result['probe_timeouts']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Окружение Alembic для auth-service"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import text
+
+config = context.config
+
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+# Ключ advisory lock: реплики стартуют одновременно, миграции выполняет только одна
+MIGRATION_LOCK_ID = 8000
+
+
+def _target_metadata():
+    from app.database import Base
+    from app import models  # noqa: F401 - регистрирует таблицы в Base.metadata
+    return Base.metadata
+
+
+def run_migrations_offline() -> None:
+    from app.database import DATABASE_URL
+
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=_target_metadata(),
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def _run_with_lock(connection) -> None:
+    is_postgres = connection.dialect.name == "postgresql"
+    if is_postgres:
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        connection.commit()
+    try:
+        target_metadata = config.attributes.get("target_metadata")
+        if target_metadata is None:
+            target_metadata = _target_metadata()
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        if is_postgres:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            connection.commit()
+
+
+def run_migrations_online() -> None:
+    # При запуске из сервиса (database.init_db) соединение передается через attributes
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run_with_lock(connection)
+        return
+
+    from app.database import engine
+
+    with engine.connect() as connection:
+        _run_with_lock(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
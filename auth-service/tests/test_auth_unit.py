@@ -153,6 +153,179 @@ def test_database_models():
         print('Models module not available (skipping)')
 
 
+def test_metrics_endpoint():
+    """Тест метрик пула соединений"""
+    client.get('/users/me')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    pool = response.json()['db_pool']
+    assert 'pool' in pool
+    if 'checkouts' in pool:
+        assert pool['checkout_timeouts'] >= 0
+        assert pool['checked_out'] <= pool['size'] + pool['max_overflow']
+
+
+
+def test_user_cache_invalidated_on_update_and_delete():
+    """Тест кэша пользователей: повторный /users/me из кэша, изменения видны сразу"""
+    import uuid
+    from app.user_cache import user_cache
+
+    suffix = uuid.uuid4().hex[:8]
+    admin = client.post('/register', json={
+        'email': f'cache_admin_{suffix}@example.com', 'password': 'adminpass',
+        'role': 'system_admin', 'branch_id': 0
+    }).json()
+    admin_headers = {'Authorization': f"Bearer {create_access_token({'user_id': admin['id']})}"}
+    user = client.post('/users', headers=admin_headers, json={
+        'email': f'cache_user_{suffix}@example.com', 'password': 'userpass',
+        'role': 'accountant', 'branch_id': 3
+    }).json()
+    headers = {'Authorization': f"Bearer {create_access_token({'user_id': user['id']})}"}
+
+    client.get('/users/me', headers=headers)
+    hits = user_cache.hits
+    assert client.get('/users/me', headers=headers).json()['branch_id'] == 3
+    assert user_cache.hits == hits + 1
+
+    client.put(f"/users/{user['id']}", headers=admin_headers, json={'role': 'manager'})
+    assert client.get('/users/me', headers=headers).json()['role'] == 'manager'
+    client.delete(f"/users/{user['id']}", headers=admin_headers)
+    assert client.get('/users/me', headers=headers).status_code == 401
+    assert 'hit_rate' in client.get('/metrics').json()['user_cache']
+
+
+
+def test_hash_pool_rejects_when_queue_is_full(monkeypatch):
+    """Тест пула bcrypt: при заполненной очереди регистрация сразу получает 503"""
+    import uuid
+    from app import hashing
+
+    busy = hashing.HashPool(workers=1, queue_limit=0)
+    monkeypatch.setattr(hashing, 'hash_pool', busy)
+    busy._acquire()
+    response = client.post('/register', json={
+        'email': f'busy_{uuid.uuid4().hex[:8]}@example.com', 'password': 'pass1234',
+        'role': 'accountant', 'branch_id': 1
+    })
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == str(hashing.RETRY_AFTER_SECONDS)
+    assert busy.stats()['rejected'] == 1
+    busy._release()
+
+
+def test_hash_pool_recovers_from_dead_worker():
+    """Тест пула bcrypt: после гибели процесса пул пересоздается, а не отвечает ошибкой вечно"""
+    import asyncio
+    import signal
+    from app import hashing
+
+    pool = hashing.HashPool(workers=1, queue_limit=1)
+    try:
+        first_pid = asyncio.run(pool.run(os.getpid))
+        os.kill(first_pid, signal.SIGKILL)
+        second_pid = asyncio.run(pool.run(os.getpid))
+        assert asyncio.run(pool.run(os.getpid)) == second_pid
+    finally:
+        pool.shutdown()
+    assert second_pid != first_pid
+    assert pool.stats()['restarts'] == 1 and pool.stats()['in_flight'] == 0
+
+
+def test_login_rehashes_stale_bcrypt_cost():
+    """Тест логина: хэш с устаревшей стоимостью bcrypt пересчитывается и сохраняется"""
+    import uuid
+    from passlib.hash import bcrypt
+    from app import auth_utils
+    from app.database import SessionLocal
+
+    email = f'rehash_{uuid.uuid4().hex[:8]}@example.com'
+    stale_rounds = 4 if auth_utils.BCRYPT_ROUNDS != 4 else 5
+    with SessionLocal() as db:
+        db.add(User(email=email, hashed_password=bcrypt.using(rounds=stale_rounds).hash('oldpass'),
+                    role='accountant', branch_id=1))
+        db.commit()
+
+    assert client.post('/login', json={'email': email, 'password': 'wrongpass'}).status_code == 401
+    assert client.post('/login', json={'email': email, 'password': 'oldpass'}).status_code == 200
+    with SessionLocal() as db:
+        stored = db.query(User).filter(User.email == email).one().hashed_password
+    assert bcrypt.from_string(stored).rounds == auth_utils.BCRYPT_ROUNDS
+    assert not auth_utils.pwd_context.needs_update(stored)
+    assert client.post('/login', json={'email': email, 'password': 'oldpass'}).status_code == 200
+
+
+def test_bulk_user_import():
+    """Тест массового импорта: занятые и повторные email пропускаются, остальные создаются"""
+    import uuid
+
+    suffix = uuid.uuid4().hex[:8]
+    admin = client.post('/register', json={
+        'email': f'bulk_admin_{suffix}@example.com', 'password': 'adminpass',
+        'role': 'system_admin', 'branch_id': 0
+    }).json()
+    admin_headers = {'Authorization': f"Bearer {create_access_token({'user_id': admin['id']})}"}
+    users = [
+        {'email': f'bulk_{index}_{suffix}@example.com', 'password': f'pass{index}',
+         'role': 'accountant', 'branch_id': index}
+        for index in range(3)
+    ]
+    users.append(dict(users[0], password='other'))
+    users.append({'email': admin['email'], 'password': 'x', 'role': 'accountant', 'branch_id': 1})
+
+    response = client.post('/users/bulk', headers=admin_headers, json={'users': users})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body['created'], body['skipped']) == (3, 2)
+    statuses = [result['status'] for result in body['results']]
+    assert statuses == ['created'] * 3 + ['duplicate', 'exists']
+    assert all(result['id'] for result in body['results'][:3])
+    login = client.post('/login', json={'email': users[2]['email'], 'password': 'pass2'})
+    assert login.status_code == 200
+
+    member_token = create_access_token({'user_id': body['results'][0]['id']})
+    member_headers = {'Authorization': f"Bearer {member_token}"}
+    response = client.post('/users/bulk', headers=member_headers, json={'users': users[:1]})
+    assert response.status_code == 403
+    assert client.post('/users/bulk', headers=admin_headers, json={'users': []}).status_code == 422
+
+
+def test_bulk_hashing_lets_login_through(monkeypatch):
+    """Тест пула bcrypt: логин во время массового хэширования не ждет весь импорт"""
+    import asyncio
+    from app import auth_utils, hashing
+
+    pool = hashing.HashPool(workers=1, queue_limit=4)
+    monkeypatch.setattr(hashing, 'hash_pool', pool)
+    stored = get_password_hash('login-pass')
+    finished = []
+
+    async def bulk():
+        hashes = await hashing.hash_passwords([f'pass{n}' for n in range(4)])
+        finished.append('bulk')
+        return hashes
+
+    async def login():
+        await asyncio.sleep(0.05)
+        verified, _new_hash = await hashing.verify_and_update('login-pass', stored)
+        assert verified
+        finished.append('login')
+
+    async def scenario():
+        hashes, _ = await asyncio.gather(bulk(), login())
+        return hashes
+
+    try:
+        pool.start()
+        hashes = asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+    assert finished == ['login', 'bulk']
+    verified = [auth_utils.verify_password(f'pass{n}', hashed) for n, hashed in enumerate(hashes)]
+    assert verified == [True] * 4
+    assert pool.stats()['completed'] == 5
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
 
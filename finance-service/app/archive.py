@@ -0,0 +1,578 @@
+"""
+Холодный архив операций: закрытые месяцы переносятся из таблицы operations
+в сжатые файлы Parquet (zstd) на локальном диске.
+
+    FINANCE_ARCHIVE_DIR/
+        2023-01/branch_7.parquet    операции филиала за месяц, по (created_at, id)
+        2023-01/branch_7.json       манифест: число строк, итоги, диапазон id, sha256 файла
+
+Месяц переносится целиком для всех филиалов, от старых к новым: файлы пишутся
+в 2023-01.tmp/, затем строки месяца удаляются из operations (на PostgreSQL
+партиция месяца отсоединяется и удаляется) и каталог переименовывается в
+2023-01. Если процесс упал между удалением строк и переименованием, каталог
+.tmp публикуется при следующем run, list или verify (recover_pending).
+
+Поэтому строки архива всегда старше строк горячей таблицы: GET /operations
+дочитывает архив после горячих строк, /operations/timeseries добавляет его
+к итогам периодов. branch_balances при переносе не меняется, ledger verify
+учитывает итоги из манифестов. Поиска по описанию (q) в архиве нет: полнотекстовый
+индекс есть только у таблицы, и GET /operations?q= не принимает диапазон,
+задевающий архивные месяцы.
+
+    python -m app.archive list
+    python -m app.archive run [YYYY-MM]    # перенести месяцы раньше указанного
+                                           # (по умолчанию - до начала года)
+    python -m app.archive verify           # сверить файлы с манифестами
+
+Нужен pyarrow; без него сервис работает, пока архив пуст.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from collections import defaultdict, namedtuple
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select, text, delete
+from sqlalchemy.engine import Connection
+
+from . import models, partitions
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = ds = pq = None
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARCHIVE_DIR = os.getenv("FINANCE_ARCHIVE_DIR", os.path.join(SERVICE_DIR, "archive"))
+COMPRESSION = "zstd"
+# Сколько строк читается из базы и пишется в файл за один раз
+WRITE_BATCH_ROWS = 50_000
+# Сколько строк архива переводится в Python и отдается клиенту за один раз
+READ_BATCH_ROWS = 10_000
+COLUMNS = ("id", "type", "amount", "description", "user_id", "branch_id", "created_at")
+PENDING_SUFFIX = ".tmp"
+
+def _schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("type", pa.string()),
+        ("amount", pa.float64()),
+        ("description", pa.string()),
+        ("user_id", pa.int64()),
+        ("branch_id", pa.int64()),
+        ("created_at", pa.timestamp("us")),
+    ])
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Для архива операций нужен pyarrow (pip install pyarrow)")
+
+def month_label(month: date) -> str:
+    return f"{month.year:04d}-{month.month:02d}"
+
+def _root(root: Optional[str]) -> str:
+    return root or ARCHIVE_DIR
+
+# --- Каталог опубликованных месяцев ---
+
+_catalog_lock = threading.Lock()
+_catalog_key = None
+_catalog: Dict[date, Dict[int, dict]] = {}
+
+def _month_dirs(root: str) -> List[Tuple[date, str, int]]:
+    found = []
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return found
+    for entry in entries:
+        if not entry.is_dir() or entry.name.endswith(PENDING_SUFFIX):
+            continue
+        try:
+            month = datetime.strptime(entry.name, "%Y-%m").date()
+        except ValueError:
+            continue
+        found.append((month, entry.path, entry.stat().st_mtime_ns))
+    return sorted(found)
+
+def catalog(root: Optional[str] = None) -> Dict[date, Dict[int, dict]]:
+    """Опубликованные месяцы архива: {месяц: {branch_id: манифест}}.
+
+    Манифесты перечитываются, только если изменился набор каталогов месяцев
+    или время их изменения: перенос в другом процессе виден сразу.
+    """
+    global _catalog_key, _catalog
+    root = _root(root)
+    months = _month_dirs(root)
+    key = (root, tuple((month, mtime) for month, _path, mtime in months))
+    with _catalog_lock:
+        if key == _catalog_key:
+            return _catalog
+    loaded = {}
+    for month, path, _mtime in months:
+        manifests = {}
+        for name in os.listdir(path):
+            if name.endswith(".json"):
+                with open(os.path.join(path, name), encoding="utf-8") as file:
+                    manifest = json.load(file)
+                file_path = os.path.join(path, manifest["file"])
+                manifests[manifest["branch_id"]] = dict(manifest, path=file_path)
+        loaded[month] = manifests
+    with _catalog_lock:
+        _catalog_key, _catalog = key, loaded
+    return loaded
+
+def totals(root: Optional[str] = None) -> Dict[int, Tuple[float, float, int]]:
+    """Итоги архива по филиалам из манифестов: (доходы, расходы, число операций)"""
+    result = defaultdict(lambda: [0.0, 0.0, 0])
+    for manifests in catalog(root).values():
+        for branch_id, manifest in manifests.items():
+            result[branch_id][0] += manifest["income"]
+            result[branch_id][1] += manifest["expense"]
+            result[branch_id][2] += manifest["rows"]
+    return {branch_id: tuple(values) for branch_id, values in result.items()}
+
+# --- Чтение ---
+
+def _months_in_range(months: Iterable[date], date_from: Optional[datetime],
+                     date_to: Optional[datetime]):
+    for month in months:
+        if date_to is not None and datetime.combine(month, datetime.min.time()) >= date_to:
+            continue
+        month_end = datetime.combine(partitions.add_months(month, 1), datetime.min.time())
+        if date_from is not None and month_end <= date_from:
+            continue
+        yield month
+
+def _filter_expression(before=None, since_id=None, date_from=None, date_to=None,
+                       operation_type=None, min_amount=None, max_amount=None, user_id=None):
+    """Условие pyarrow с теми же фильтрами, что и у SQL-запроса GET /operations"""
+    field = pc.field
+    conditions = []
+    if before is not None:
+        created_at, operation_id = before
+        created_at = pa.scalar(created_at, pa.timestamp("us"))
+        conditions.append((field("created_at") < created_at)
+                          | ((field("created_at") == created_at) & (field("id") < operation_id)))
+    if since_id is not None:
+        conditions.append(field("id") > since_id)
+    if date_from is not None:
+        conditions.append(field("created_at") >= pa.scalar(date_from, pa.timestamp("us")))
+    if date_to is not None:
+        conditions.append(field("created_at") < pa.scalar(date_to, pa.timestamp("us")))
+    if operation_type is not None:
+        conditions.append(field("type") == operation_type)
+    if min_amount is not None:
+        conditions.append(field("amount") >= min_amount)
+    if max_amount is not None:
+        conditions.append(field("amount") <= max_amount)
+    if user_id is not None:
+        conditions.append(field("user_id") == user_id)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def archived_months(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                    root: Optional[str] = None) -> List[date]:
+    """Месяцы архива, пересекающиеся с [date_from, date_to), по возрастанию"""
+    return list(_months_in_range(sorted(catalog(root)), date_from, date_to))
+
+def _month_paths(manifests: Dict[int, dict], branch_ids: Optional[Sequence[int]]) -> List[str]:
+    return [manifest["path"] for branch_id, manifest in manifests.items()
+            if branch_ids is None or branch_id in branch_ids]
+
+def iter_operations(branch_ids: Optional[Sequence[int]], limit: Optional[int] = None,
+                    root: Optional[str] = None, **filters) -> Iterator[List[dict]]:
+    """Операции из архива в порядке (created_at, id) по убыванию, не больше limit,
+    порциями не больше READ_BATCH_ROWS строк.
+
+    branch_ids=None - все филиалы; filters - before=(created_at, id), since_id,
+    date_from, date_to, operation_type, min_amount, max_amount, user_id.
+    Месяцы читаются от новых к старым, пока не набрано limit строк; в памяти
+    одновременно только таблица одного месяца.
+    """
+    months = catalog(root)
+    if not months or limit == 0:
+        return
+    _require_pyarrow()
+    before = filters.get("before")
+    date_to = filters.get("date_to")
+    if before is not None:
+        # Курсор отсекает более новые месяцы так же, как date_to
+        _start, cursor_end = _month_bounds(partitions.month_start(before[0]))
+        date_to = cursor_end if date_to is None else min(date_to, cursor_end)
+    expression = _filter_expression(**filters)
+    remaining = limit
+    for month in _months_in_range(sorted(months, reverse=True), filters.get("date_from"), date_to):
+        paths = _month_paths(months[month], branch_ids)
+        if not paths:
+            continue
+        # Файлы месяца читаются одним набором (параллельно),
+        # сортировка и срез - до перевода в Python
+        table = ds.dataset(paths, format="parquet", schema=_schema()).to_table(filter=expression)
+        table = table.sort_by([("created_at", "descending"), ("id", "descending")])
+        if remaining is not None:
+            table = table.slice(0, remaining)
+            remaining -= table.num_rows
+        for batch in table.to_batches(max_chunksize=READ_BATCH_ROWS):
+            if batch.num_rows:
+                yield batch.to_pylist()
+        if remaining == 0:
+            break
+
+@lru_cache(maxsize=64)
+def _row_type(names: Tuple[str, ...]):
+    return namedtuple("ArchivedOperation", names)
+
+def as_rows(operations: Iterable[dict], names: Sequence[str]) -> list:
+    """Строки архива в виде кортежей колонок names, как строки SQL-запроса"""
+    row_type = _row_type(tuple(names))
+    return [row_type(*(operation[name] for name in names)) for operation in operations]
+
+def timeseries(branch_ids: Optional[Sequence[int]], interval: str, root: Optional[str] = None,
+               **filters) -> Dict[datetime, List]:
+    """Доходы, расходы и число операций архива по периодам:
+    {начало периода: [income, expense, count]}.
+
+    Суммы считает pyarrow по месяцу за раз; в Python попадают только итоги групп.
+    Периоды начинаются как в timeseries.py: день, понедельник недели, первое число месяца.
+    """
+    def bucket(table):
+        return pc.floor_temporal(table["created_at"], unit=interval, week_starts_monday=True)
+
+    return _aggregate(branch_ids, root, filters, "bucket", "created_at", bucket)
+
+def branch_totals(branch_ids: Optional[Sequence[int]], root: Optional[str] = None,
+                  **filters) -> Dict[int, List]:
+    """Доходы, расходы и число операций архива по филиалам:
+    {branch_id: [income, expense, count]}.
+
+    Для итогов за период и тип; без фильтров те же числа дает totals() по манифестам.
+    """
+    return _aggregate(branch_ids, root, filters, "branch_id", "branch_id")
+
+def _aggregate(branch_ids: Optional[Sequence[int]], root: Optional[str], filters: dict, key: str,
+               source: str, make_key=None) -> Dict[Any, List]:
+    """Итоги архива по значениям key: колонка source файла
+    или make_key(table), посчитанная из нее"""
+    groups = defaultdict(lambda: [0.0, 0.0, 0])
+    months = catalog(root)
+    if not months:
+        return groups
+    _require_pyarrow()
+    expression = _filter_expression(**filters)
+    for month in _months_in_range(sorted(months), filters.get("date_from"), filters.get("date_to")):
+        paths = _month_paths(months[month], branch_ids)
+        if not paths:
+            continue
+        table = ds.dataset(paths, format="parquet", schema=_schema()).to_table(
+            columns=[source, "type", "amount"], filter=expression
+        )
+        if not table.num_rows:
+            continue
+        if make_key is not None:
+            table = table.append_column(key, make_key(table))
+        grouped = table.group_by([key, "type"]).aggregate([("amount", "sum"), ("amount", "count")])
+        names = (key, "type", "amount_sum", "amount_count")
+        columns = (grouped[name].to_pylist() for name in names)
+        for value, kind, amount, count in zip(*columns):
+            values = groups[value]
+            values[0 if kind == "income" else 1] += amount
+            values[2] += count
+    return groups
+
+# --- Перенос месяца ---
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_json(path: str, content: dict):
+    with open(path + ".part", "w", encoding="utf-8") as file:
+        json.dump(content, file, ensure_ascii=False, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".part", path)
+
+class _BranchWriter:
+    """Файл Parquet и манифест одного филиала за месяц"""
+
+    def __init__(self, directory: str, month: date, branch_id: int):
+        self.directory = directory
+        self.month = month
+        self.branch_id = branch_id
+        self.file = f"branch_{branch_id}.parquet"
+        self.writer = pq.ParquetWriter(
+            os.path.join(directory, self.file), _schema(), compression=COMPRESSION
+        )
+        self.rows = 0
+        self.income = 0.0
+        self.expense = 0.0
+        self.min_id = None
+        self.max_id = None
+
+    def write(self, rows: List[dict]):
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=_schema()))
+        for row in rows:
+            if row["type"] == "income":
+                self.income += row["amount"]
+            else:
+                self.expense += row["amount"]
+            self.min_id = row["id"] if self.min_id is None else min(self.min_id, row["id"])
+            self.max_id = row["id"] if self.max_id is None else max(self.max_id, row["id"])
+        self.rows += len(rows)
+
+    def close(self) -> dict:
+        self.writer.close()
+        path = os.path.join(self.directory, self.file)
+        manifest = {
+            "month": month_label(self.month),
+            "branch_id": self.branch_id,
+            "file": self.file,
+            "format": "parquet",
+            "compression": COMPRESSION,
+            "rows": self.rows,
+            "income": self.income,
+            "expense": self.expense,
+            "min_id": self.min_id,
+            "max_id": self.max_id,
+            "bytes": os.path.getsize(path),
+            "sha256": _sha256(path),
+            "archived_at": datetime.utcnow().isoformat(),
+        }
+        _write_json(os.path.join(self.directory, f"branch_{self.branch_id}.json"), manifest)
+        return manifest
+
+def _month_bounds(month: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(month, datetime.min.time())
+    return start, datetime.combine(partitions.add_months(month, 1), datetime.min.time())
+
+def _month_condition(month: date):
+    start, end = _month_bounds(month)
+    return (models.Operation.created_at >= start) & (models.Operation.created_at < end)
+
+def _month_has_rows(connection: Connection, month: date) -> bool:
+    statement = select(models.Operation.id).where(_month_condition(month)).limit(1)
+    return connection.execute(statement).first() is not None
+
+def _write_month(connection: Connection, month: date, directory: str) -> List[dict]:
+    """Пишет операции месяца в файлы филиалов каталога directory, возвращает манифесты"""
+    columns = [getattr(models.Operation, name) for name in COLUMNS]
+    statement = (
+        select(*columns)
+        .where(_month_condition(month))
+        .order_by(models.Operation.branch_id, models.Operation.created_at, models.Operation.id)
+        .execution_options(yield_per=WRITE_BATCH_ROWS)
+    )
+    manifests = []
+    writer = None
+    for partition in connection.execute(statement).mappings().partitions():
+        pending = []
+        for row in partition:
+            if writer is None or writer.branch_id != row["branch_id"]:
+                if pending:
+                    writer.write(pending)
+                    pending = []
+                if writer is not None:
+                    manifests.append(writer.close())
+                writer = _BranchWriter(directory, month, row["branch_id"])
+            pending.append(dict(row))
+        if pending:
+            writer.write(pending)
+    if writer is not None:
+        manifests.append(writer.close())
+    return manifests
+
+def _check_files(manifests: List[dict], directory: str):
+    """Перечитывает метаданные записанных файлов: число строк должно совпасть с манифестами"""
+    for manifest in manifests:
+        rows = pq.ParquetFile(os.path.join(directory, manifest["file"])).metadata.num_rows
+        if rows != manifest["rows"]:
+            raise RuntimeError(f"{manifest['month']} филиал {manifest['branch_id']}: "
+                               "файл не совпадает с манифестом")
+
+def _delete_month(connection: Connection, month: date, manifests: List[dict]):
+    """Удаляет строки месяца из operations, если они совпадают с записанными в архив"""
+    counts = dict(connection.execute(
+        select(models.Operation.branch_id, func.count(models.Operation.id))
+        .where(_month_condition(month))
+        .group_by(models.Operation.branch_id)
+    ).all())
+    archived = {manifest["branch_id"]: manifest["rows"] for manifest in manifests}
+    if counts != archived:
+        raise RuntimeError(f"{month_label(month)}: строки в базе изменились во время переноса")
+    name = partitions.partition_name(month)
+    if partitions.is_partitioned(connection) and name in partitions.list_partitions(connection):
+        # Партиция месяца целиком уходит в архив: DETACH и DROP вместо построчного DELETE
+        connection.execute(text(f"ALTER TABLE {partitions.PARENT_TABLE} DETACH PARTITION {name}"))
+        connection.execute(text(f"DROP TABLE {name}"))
+    # Строки месяца в operations_default (или вся таблица без партиций)
+    connection.execute(delete(models.Operation).where(_month_condition(month)))
+
+def _pending_months(root: str) -> List[Tuple[date, str]]:
+    found = []
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return found
+    for entry in entries:
+        if not entry.is_dir() or not entry.name.endswith(PENDING_SUFFIX):
+            continue
+        try:
+            month = datetime.strptime(entry.name[:-len(PENDING_SUFFIX)], "%Y-%m").date()
+        except ValueError:
+            continue
+        found.append((month, entry.path))
+    return sorted(found)
+
+def _read_manifests(directory: str) -> List[dict]:
+    manifests = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as file:
+                manifests.append(json.load(file))
+    return manifests
+
+def recover_pending(connection: Connection, root: Optional[str] = None) -> List[date]:
+    """Публикует каталоги .tmp, чьи строки уже удалены из operations; возвращает их месяцы.
+
+    Каталог публикуется, только если в operations не осталось строк месяца и файлы
+    совпадают с манифестами. Каталоги месяцев, строки которых еще в базе, не
+    трогаются: это незавершенный или идущий сейчас перенос, archive_month перепишет их.
+    """
+    recovered = []
+    root = _root(root)
+    for month, pending in _pending_months(root):
+        has_rows = _month_has_rows(connection, month)
+        connection.commit()
+        published = os.path.join(root, month_label(month))
+        if has_rows or os.path.exists(published):
+            continue
+        _require_pyarrow()
+        _check_files(_read_manifests(pending), pending)
+        os.replace(pending, published)
+        recovered.append(month)
+    return recovered
+
+def archive_month(connection: Connection, month: date, root: Optional[str] = None) -> List[dict]:
+    """Переносит операции месяца в архив и удаляет их из operations; возвращает манифесты"""
+    _require_pyarrow()
+    month = partitions.month_start(month)
+    root = _root(root)
+    published = os.path.join(root, month_label(month))
+    pending = published + PENDING_SUFFIX
+    has_rows = _month_has_rows(connection, month)
+    connection.commit()
+    if not has_rows:
+        # Прошлый запуск удалил строки, но не успел опубликовать каталог
+        if os.path.isdir(pending) and not os.path.exists(published):
+            os.replace(pending, published)
+        return []
+    if os.path.exists(published):
+        raise RuntimeError(
+            f"{month_label(month)} уже в архиве, но в operations есть строки этого месяца"
+        )
+    shutil.rmtree(pending, ignore_errors=True)
+    os.makedirs(pending)
+    manifests = _write_month(connection, month, pending)
+    _check_files(manifests, pending)
+    connection.commit()
+    try:
+        _delete_month(connection, month, manifests)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        shutil.rmtree(pending, ignore_errors=True)
+        raise
+    os.replace(pending, published)
+    return manifests
+
+def archive_before(connection: Connection, cutoff: date,
+                   root: Optional[str] = None) -> Dict[date, List[dict]]:
+    """Переносит в архив все месяцы раньше cutoff, от старых к новым.
+
+    Сначала публикует месяцы, перенос которых прервался после удаления строк.
+    """
+    cutoff = partitions.month_start(cutoff)
+    if cutoff > partitions.month_start(datetime.utcnow()):
+        raise ValueError("Текущий месяц еще не закрыт, его нельзя перенести в архив")
+    recover_pending(connection, root)
+    oldest = connection.execute(
+        select(func.min(models.Operation.created_at))
+        .where(models.Operation.created_at < datetime.combine(cutoff, datetime.min.time()))
+    ).scalar()
+    connection.commit()
+    done = {}
+    month = partitions.month_start(oldest) if oldest is not None else cutoff
+    while month < cutoff:
+        manifests = archive_month(connection, month, root)
+        if manifests:
+            done[month] = manifests
+        month = partitions.add_months(month, 1)
+    return done
+
+def verify_files(root: Optional[str] = None) -> List[str]:
+    """Сверяет файлы архива с sha256 из манифестов, возвращает описания расхождений"""
+    problems = []
+    for month, manifests in sorted(catalog(root).items()):
+        for branch_id, manifest in sorted(manifests.items()):
+            if not os.path.exists(manifest["path"]):
+                problems.append(
+                    f"{month_label(month)} филиал {branch_id}: нет файла {manifest['file']}"
+                )
+            elif _sha256(manifest["path"]) != manifest["sha256"]:
+                problems.append(f"{month_label(month)} филиал {branch_id}: sha256 не совпадает")
+    return problems
+
+def main(argv: List[str]) -> int:
+    from .database import engine
+
+    command = argv[0] if argv else "list"
+    if command in ("list", "verify"):
+        with engine.connect() as connection:
+            for month in recover_pending(connection):
+                print(f"⚠️  {month_label(month)}: "
+                      "опубликован перенос, прерванный после удаления строк")
+    if command == "list":
+        for month, manifests in sorted(catalog().items()):
+            rows = sum(manifest["rows"] for manifest in manifests.values())
+            size = sum(manifest["bytes"] for manifest in manifests.values())
+            print(f"{month_label(month)}  филиалов: {len(manifests)}  строк: {rows}  байт: {size}")
+        return 0
+    if command == "run":
+        if len(argv) > 1:
+            cutoff = datetime.strptime(argv[1], "%Y-%m").date()
+        else:
+            cutoff = date(datetime.utcnow().year, 1, 1)
+        with engine.connect() as connection:
+            done = archive_before(connection, cutoff)
+        for month, manifests in done.items():
+            rows = sum(m["rows"] for m in manifests)
+            print(f"✅ {month_label(month)}: филиалов {len(manifests)}, строк {rows}")
+        print(f"✅ Перенесено месяцев: {len(done)}")
+        return 0
+    if command == "verify":
+        problems = verify_files()
+        for problem in problems:
+            print(f"❌ {problem}")
+        if problems:
+            return 1
+        print("✅ Файлы архива совпадают с манифестами")
+        return 0
+    print("Использование: python -m app.archive [list|run [YYYY-MM]|verify]")
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
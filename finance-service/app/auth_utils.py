@@ -1,18 +1,91 @@
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
+from collections import OrderedDict
 from typing import Optional
+import hashlib
+import os
+import threading
+import time
 
 # ДОЛЖЕН БЫТЬ ТОТ ЖЕ СЕКРЕТНЫЙ КЛЮЧ ЧТО И В AUTH-SERVICE!
 SECRET_KEY = "your-secret-key-for-development-change-in-production"
 ALGORITHM = "HS256"
 
+# Кэш проверенных токенов: сколько хранить (0 - без кэша) и предельный срок
+# для токенов без exp
+TOKEN_CACHE_SIZE = int(os.getenv("FINANCE_TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("FINANCE_TOKEN_CACHE_TTL_SECONDS", "300"))
+
+class TokenCache:
+    """LRU проверенных payload по sha256 токена.
+
+    Запись живет не дольше exp токена (и не дольше ttl): просроченный токен
+    из кэша не выдается, а уходит на полную проверку jwt.decode и отклоняется.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: bytes) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, payload: dict):
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+token_cache = TokenCache()
+
 def verify_token(token: str) -> Optional[dict]:
-    """Проверяет JWT токен и возвращает payload"""
+    """Проверяет JWT токен и возвращает payload (повторные проверки - из token_cache)"""
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        # Копия: вызывающий может изменить словарь, не трогая кэш
+        return dict(payload)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    token_cache.put(key, payload)
+    return dict(payload)
 
 def get_current_user(token: str):
     """Получает пользователя из токена"""
@@ -22,4 +95,4 @@ def get_current_user(token: str):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
         )
-    return payload
\ No newline at end of file
+    return payload
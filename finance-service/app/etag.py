@@ -0,0 +1,39 @@
+import hashlib
+import json
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+
+from . import models
+
+# Ответ можно хранить только в кэше браузера и только с обязательной перепроверкой
+CACHE_CONTROL = "private, no-cache"
+
+def version_statement(branch_ids: Optional[Iterable[int]] = None):
+    """Версия данных набора филиалов (None - все филиалы).
+
+    Версия филиала растет при каждой записи, поэтому сумма по набору тоже
+    строго растет при любой записи в любой из его филиалов.
+    """
+    statement = select(func.coalesce(func.sum(models.BranchBalance.version), 0))
+    if branch_ids is not None:
+        statement = statement.where(models.BranchBalance.branch_id.in_(list(branch_ids)))
+    return statement
+
+def make_etag(scope: str, filters: Iterable, version: int) -> str:
+    """Сильный ETag из области видимости, параметров запроса и версии данных"""
+    raw = json.dumps([scope, sorted(filters), version], separators=(",", ":"), default=str)
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+def cache_headers(tag: str) -> dict:
+    return {"ETag": tag, "Cache-Control": CACHE_CONTROL}
+
+def if_none_match(header: Optional[str], etag: str) -> bool:
+    """True, если ETag совпал с одним из значений If-None-Match (слабое сравнение, RFC 9110)"""
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
@@ -0,0 +1,101 @@
+"""
+Быстрая сериализация списков операций для GET /operations.
+
+Строки выбираются кортежами колонок через SQLAlchemy Core и кодируются orjson
+прямо в байты, без ORM-объектов и проверки через OperationResponse.
+Результат совпадает байт в байт с прежним ответом FastAPI (и с model_dump_json
+для NDJSON). Исключение - экспоненциальная запись чисел: orjson пишет 1e16,
+json - 1e+16, поэтому ответы с суммами вне [1e-4, 1e16) кодируются прежним путем.
+
+Параметр fields (?fields=id,amount) сужает и SELECT, и ответ до перечисленных
+полей; поля всегда идут в порядке OperationResponse.
+"""
+import json
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+import orjson
+
+from . import models, schemas
+
+# Порядок полей ответа совпадает с OperationResponse
+OPERATION_FIELDS = tuple(schemas.OperationResponse.model_fields)
+
+def parse_fields(value: Optional[str]) -> Tuple[str, ...]:
+    """Поля из параметра fields (через запятую); ValueError для неизвестных полей"""
+    if not value:
+        return OPERATION_FIELDS
+    requested = {field.strip() for field in value.split(",") if field.strip()}
+    unknown = requested - set(OPERATION_FIELDS)
+    if unknown or not requested:
+        raise ValueError(", ".join(sorted(unknown)))
+    return tuple(field for field in OPERATION_FIELDS if field in requested)
+
+def operation_column_names(fields: Sequence[str] = OPERATION_FIELDS,
+                           extra: Sequence[str] = ()) -> Tuple[str, ...]:
+    """Имена колонок строки: поля ответа, затем служебные колонки extra, которых нет среди полей"""
+    return tuple(fields) + tuple(name for name in extra if name not in fields)
+
+def operation_columns(fields: Sequence[str] = OPERATION_FIELDS, extra: Sequence[str] = ()):
+    """Колонки operations для полей ответа; extra - служебные колонки в конце строки
+    (например, id и created_at для курсора), в ответ они не попадают"""
+    return tuple(getattr(models.Operation, name) for name in operation_column_names(fields, extra))
+
+def _plain_amount(amount: float) -> bool:
+    """True, если orjson и json запишут число одинаково (без экспоненты)"""
+    return amount == 0 or 1e-4 <= abs(amount) < 1e16
+
+def _as_dicts(rows: Sequence, fields: Sequence[str]) -> tuple:
+    """Словари полей и признак того, что все суммы можно кодировать orjson"""
+    plain = True
+    amount_index = fields.index("amount") if "amount" in fields else None
+    items = []
+    for row in rows:
+        if plain and amount_index is not None and not _plain_amount(row[amount_index]):
+            plain = False
+        # zip по fields отбрасывает служебные колонки в конце строки
+        items.append(dict(zip(fields, row)))
+    return items, plain
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+def _stdlib_dumps(content) -> bytes:
+    """Кодирование как в JSONResponse FastAPI (datetime - как в pydantic, isoformat)"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":"), default=_isoformat).encode("utf-8")
+
+def encode_list(rows: Sequence, fields: Sequence[str] = OPERATION_FIELDS) -> bytes:
+    """JSON-массив операций из кортежей колонок"""
+    items, plain = _as_dicts(rows, fields)
+    if plain:
+        return orjson.dumps(items)
+    return _stdlib_dumps(items)
+
+def encode_list_items(rows: Sequence, fields: Sequence[str] = OPERATION_FIELDS) -> bytes:
+    """Элементы JSON-массива без скобок: массив по частям собирается из таких кусков
+    через запятую"""
+    return encode_list(rows, fields)[1:-1]
+
+def encode_page(rows: Sequence, next_cursor: Optional[str],
+                fields: Sequence[str] = OPERATION_FIELDS) -> bytes:
+    """Страница {items, next_cursor} из кортежей колонок"""
+    items, plain = _as_dicts(rows, fields)
+    page = {"items": items, "next_cursor": next_cursor}
+    if plain:
+        return orjson.dumps(page)
+    return _stdlib_dumps(page)
+
+def encode_ndjson(rows: Sequence, fields: Sequence[str] = OPERATION_FIELDS) -> bytes:
+    """Операции по одной на строку, как OperationResponse.model_dump_json()"""
+    items, plain = _as_dicts(rows, fields)
+    if plain:
+        return b"".join(orjson.dumps(item) + b"\n" for item in items)
+    if tuple(fields) == OPERATION_FIELDS:
+        return b"".join(
+            schemas.OperationResponse.model_validate(item).model_dump_json().encode("utf-8") + b"\n"
+            for item in items
+        )
+    return b"".join(_stdlib_dumps(item) + b"\n" for item in items)
@@ -0,0 +1,171 @@
+"""
+Лента новых операций для Server-Sent Events (GET /operations/stream).
+
+Каждая операция сериализуется один раз и раздается всем подписчикам процесса
+через их очереди, без запросов к базе на каждого подписчика.
+
+На PostgreSQL транзакция вставки отправляет NOTIFY с id новых операций;
+уведомление доставляется только после commit. Каждая реплика слушает канал
+одним соединением и один раз дочитывает эти строки для всех своих подписчиков.
+На SQLite (одна реплика, локальная разработка) операции публикуются напрямую
+после commit.
+
+Живые события идут в порядке commit, а id операций выдаются последовательностью
+до commit: строка с меньшим id может закоммититься после уже доставленной.
+Поэтому повтор после переподключения (Last-Event-ID) отдает не только id больше
+последнего, но и операции, созданные за REPLAY_OVERLAP до него; клиент
+отбрасывает повторы по id. Если пропущено больше REPLAY_LIMIT операций, лента
+присылает событие reset, и клиент перезагружает список целиком.
+"""
+import asyncio
+import os
+from datetime import timedelta
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+
+from . import models, schemas
+
+CHANNEL = "finance_operations"
+# Сколько событий может ждать отправки одному подписчику; медленный клиент
+# отключается и переподключается с Last-Event-ID
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("FINANCE_FEED_QUEUE_SIZE", "1000"))
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+# Payload NOTIFY ограничен 8000 байтами
+NOTIFY_IDS_PER_MESSAGE = 500
+LISTEN_RECONNECT_SECONDS = 5
+REPLAY_LIMIT = int(os.getenv("FINANCE_STREAM_REPLAY_LIMIT", "1000"))
+# Дольше этого транзакция вставки не должна идти, иначе ее строки могут потеряться при повторе
+REPLAY_OVERLAP = timedelta(seconds=int(os.getenv("FINANCE_STREAM_REPLAY_OVERLAP_SECONDS", "60")))
+RESET_EVENT = "event: reset\ndata: {}\n\n"
+
+def format_event(operation) -> Tuple[int, str]:
+    """Событие SSE для операции (ORM-объект или словарь): (id, готовый текст события)"""
+    data = schemas.OperationResponse.model_validate(operation).model_dump_json()
+    return data_id(operation), f"id: {data_id(operation)}\nevent: operation\ndata: {data}\n\n"
+
+def data_id(operation) -> int:
+    return operation["id"] if isinstance(operation, dict) else operation.id
+
+def data_branch(operation) -> int:
+    return operation["branch_id"] if isinstance(operation, dict) else operation.branch_id
+
+class Subscriber:
+    """Очередь событий одного подключения; branch_id=None - все филиалы"""
+
+    def __init__(self, branch_id: Optional[int]):
+        self.branch_id = branch_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+class FeedHub:
+    """Подписчики текущего процесса и раздача им событий"""
+
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, branch_id: Optional[int]) -> Subscriber:
+        self.loop = asyncio.get_running_loop()
+        subscriber = Subscriber(branch_id)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, events: List[Tuple[int, int, str]]):
+        """Раздает события (branch_id, id, текст) подписчикам. Вызывать из цикла событий."""
+        self.published += len(events)
+        for subscriber in list(self.subscribers):
+            for branch_id, operation_id, frame in events:
+                if subscriber.branch_id is not None and subscriber.branch_id != branch_id:
+                    continue
+                try:
+                    subscriber.queue.put_nowait((operation_id, frame))
+                except asyncio.QueueFull:
+                    # Вместо очереди остается только сигнал завершения потока
+                    self.unsubscribe(subscriber)
+                    self.dropped += 1
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.queue.put_nowait(None)
+                    break
+
+    def publish_operations(self, operations: Iterable):
+        """Сериализует операции и раздает их; можно вызывать и из потока пула"""
+        events = [(data_branch(operation), *format_event(operation)) for operation in operations]
+        if not events:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self.loop:
+            self.publish(events)
+        elif self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.publish, events)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+hub = FeedHub()
+
+def notify_statements(dialect_name: str, operation_ids: List[int]):
+    """SELECT pg_notify(...) с id новых операций для выполнения в транзакции вставки.
+
+    Для SQLite возвращает пустой список: там публикует publish_committed.
+    """
+    if dialect_name != "postgresql":
+        return []
+    statement = text("SELECT pg_notify(:channel, :payload)")
+    return [
+        statement.bindparams(
+            channel=CHANNEL,
+            payload=",".join(str(operation_id)
+                             for operation_id in operation_ids[i:i + NOTIFY_IDS_PER_MESSAGE]),
+        )
+        for i in range(0, len(operation_ids), NOTIFY_IDS_PER_MESSAGE)
+    ]
+
+def publish_committed(dialect_name: str, operations: Iterable):
+    """Публикует закоммиченные операции, если их не доставит NOTIFY"""
+    if dialect_name != "postgresql":
+        hub.publish_operations(operations)
+
+async def listen(async_engine, session_factory):
+    """Слушает канал NOTIFY и публикует новые операции подписчикам этой реплики"""
+    pending: asyncio.Queue = asyncio.Queue()
+
+    def on_notify(connection, pid, channel, payload):
+        pending.put_nowait([int(value) for value in payload.split(",") if value])
+
+    while True:
+        try:
+            async with async_engine.connect() as connection:
+                raw = (await connection.get_raw_connection()).driver_connection
+                await raw.add_listener(CHANNEL, on_notify)
+                while not raw.is_closed():
+                    try:
+                        operation_ids = await asyncio.wait_for(pending.get(), HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        continue
+                    async with session_factory() as db:
+                        statement = (
+                            select(models.Operation)
+                            .where(models.Operation.id.in_(operation_ids))
+                            .order_by(models.Operation.id)
+                        )
+                        operations = (await db.scalars(statement)).all()
+                    hub.publish_operations(operations)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            print(f"⚠️  Лента операций: соединение LISTEN потеряно ({error}), переподключение")
+        await asyncio.sleep(LISTEN_RECONNECT_SECONDS)
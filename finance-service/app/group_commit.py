@@ -0,0 +1,141 @@
+"""
+Групповой commit для POST /operations (FINANCE_GROUP_COMMIT=1).
+
+Одиночные вставки, пришедшие почти одновременно, собираются в пакет: до
+MAX_BATCH строк или MAX_WAIT_MS миллисекунд ожидания после первой строки.
+Пакет записывается одной транзакцией: один INSERT ... RETURNING, одно
+обновление итогов филиалов и один commit (fsync) на всех. Каждый вызывающий
+получает свою строку. Если транзакция пакета не прошла, его строки пишутся
+заново по одной: ошибка одной строки достается только ее запросу.
+
+Запросы с Idempotency-Key идут обычным путем: ключ занимается в той же
+транзакции, что и вставка.
+"""
+import asyncio
+import os
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from . import models, ledger, feed
+
+ENABLED = os.getenv("FINANCE_GROUP_COMMIT", "0") == "1"
+MAX_BATCH = int(os.getenv("FINANCE_GROUP_COMMIT_MAX_BATCH", "100"))
+MAX_WAIT_MS = float(os.getenv("FINANCE_GROUP_COMMIT_MAX_WAIT_MS", "5"))
+
+class GroupCommitter:
+    """Очередь одиночных вставок и фоновая задача, которая пишет их пакетами"""
+
+    def __init__(self, session_factory, max_batch: int = MAX_BATCH,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        # Пакет, который сейчас пишется: stop() отвечает и его запросам
+        self.in_flight: List[Tuple[dict, asyncio.Future]] = []
+        self.batches = 0
+        self.rows = 0
+        self.retried_batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self.worker is not None and not self.worker.done()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+        pending, self.in_flight = list(self.in_flight), []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for _row, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Сервис останавливается"))
+
+    async def submit(self, row: dict) -> dict:
+        """Ставит строку операции в очередь и ждет commit; возвращает ее с id и created_at"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((row, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.in_flight = batch
+            await self._commit(batch)
+            self.in_flight = []
+
+    async def _write(self, rows: List[dict]) -> Tuple[str, list]:
+        """Пишет строки одной транзакцией; возвращает диалект и (id, created_at) строк"""
+        async with self.session_factory() as db:
+            dialect_name = db.bind.dialect.name
+            statement = insert(models.Operation).returning(
+                models.Operation.id, models.Operation.created_at, sort_by_parameter_order=True
+            )
+            inserted = (await db.execute(statement, rows)).all()
+            await db.execute(ledger.upsert_statement(
+                dialect_name, ((row["branch_id"], row["type"], row["amount"]) for row in rows)
+            ))
+            new_ids = [new_id for new_id, _created_at in inserted]
+            for notify in feed.notify_statements(dialect_name, new_ids):
+                await db.execute(notify)
+            await db.commit()
+        return dialect_name, inserted
+
+    async def _commit(self, batch: List[Tuple[dict, asyncio.Future]]):
+        rows = [row for row, _future in batch]
+        try:
+            dialect_name, inserted = await self._write(rows)
+        except Exception as error:
+            if len(batch) == 1:
+                _row, future = batch[0]
+                if not future.done():
+                    future.set_exception(error)
+                return
+            # Пакет отклонила одна из строк: пишем по одной, чтобы ошибка досталась только ей
+            self.retried_batches += 1
+            for item in batch:
+                await self._commit([item])
+            return
+
+        self.batches += 1
+        self.rows += len(rows)
+        for (row, future), (new_id, created_at) in zip(batch, inserted):
+            row.update(id=new_id, created_at=created_at)
+            # Клиент мог отключиться, но его строка уже записана
+            if not future.done():
+                future.set_result(row)
+        feed.publish_committed(dialect_name, rows)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "retried_batches": self.retried_batches,
+        }
@@ -0,0 +1,63 @@
+"""
+Ключи идемпотентности для POST /operations (заголовок Idempotency-Key).
+
+Повтор запроса с тем же ключом отдает сохраненный ответ после одного чтения
+по первичному ключу (user_id, key) и ничего не пишет. Ключ занимается
+INSERT ... ON CONFLICT в начале транзакции, которая создает операцию:
+параллельный дубликат ждет на этой строке, пока первая транзакция не
+завершится, и затем получает ее ответ. Ответ сохраняется в той же
+транзакции, поэтому ключ без ответа снаружи не виден.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# Сколько хранится ответ; повтор после этого срока выполняется как новый запрос
+TTL = timedelta(hours=int(os.getenv("FINANCE_IDEMPOTENCY_TTL_HOURS", "24")))
+
+def request_hash(payload: dict) -> str:
+    """Отпечаток тела запроса: тот же ключ с другим телом - ошибка клиента"""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def claim_statement(dialect_name: str, user_id: int, key: str, fingerprint: str, now: datetime):
+    """INSERT, занимающий ключ; возвращает строку, только если ключ свободен или его срок истек"""
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    table = models.IdempotencyKey
+    statement = dialect.insert(table).values(
+        user_id=user_id,
+        key=key,
+        request_hash=fingerprint,
+        created_at=now,
+        expires_at=now + TTL,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.user_id, table.key],
+        set_={
+            "request_hash": statement.excluded.request_hash,
+            "status_code": None,
+            "response_body": None,
+            "created_at": statement.excluded.created_at,
+            "expires_at": statement.excluded.expires_at,
+        },
+        where=table.expires_at <= now,
+    )
+    return statement.returning(table.user_id)
+
+def purge_expired(db: Session) -> int:
+    """Удаляет ключи с истекшим сроком, возвращает их число"""
+    result = db.execute(
+        delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,169 @@
+"""
+Журнал итогов по филиалам (таблица branch_balances).
+
+Итоги обновляются инкрементально в транзакции, которая вставляет операции,
+поэтому /balance читает одну строку вместо всей истории филиала.
+Пересчет и сверка с сырыми операциями:
+
+    python -m app.ledger verify    # показать расхождения, код выхода 1 если они есть
+    python -m app.ledger rebuild   # пересчитать таблицу целиком
+"""
+import math
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import func, case, delete, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models, archive
+
+# Допустимое расхождение сумм при сверке (накопленная ошибка float)
+DRIFT_TOLERANCE = 0.01
+
+def totals_columns():
+    """Сумма доходов, сумма расходов и число операций (условная агрегация за один проход)"""
+    amount = models.Operation.amount
+    return (
+        func.coalesce(func.sum(case((models.Operation.type == "income", amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((models.Operation.type == "expense", amount), else_=0.0)), 0.0),
+        func.count(models.Operation.id),
+    )
+
+def upsert_statement(dialect_name: str, operations: Iterable[Tuple[int, str, float]]):
+    """INSERT ... ON CONFLICT, добавляющий операции (branch_id, type, amount) к итогам филиалов.
+
+    Возвращает None, если операций нет. Подходит и для синхронной, и для
+    асинхронной сессии: выполнять нужно в транзакции, которая вставляет операции.
+    """
+    deltas: Dict[int, List[float]] = defaultdict(lambda: [0.0, 0.0, 0])
+    for branch_id, operation_type, amount in operations:
+        delta = deltas[branch_id]
+        if operation_type == "income":
+            delta[0] += amount
+        elif operation_type == "expense":
+            delta[1] += amount
+        delta[2] += 1
+    if not deltas:
+        return None
+
+    # Строки в порядке branch_id: параллельные пакеты блокируют филиалы в одном порядке
+    now = datetime.utcnow()
+    rows = [
+        {
+            "branch_id": branch_id,
+            "total_income": income,
+            "total_expense": expense,
+            "operations_count": count,
+            "version": 1,
+            "updated_at": now,
+        }
+        for branch_id, (income, expense, count) in sorted(deltas.items())
+    ]
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    statement = dialect.insert(models.BranchBalance).values(rows)
+    table = models.BranchBalance
+    return statement.on_conflict_do_update(
+        index_elements=[table.branch_id],
+        set_={
+            "total_income": table.total_income + statement.excluded.total_income,
+            "total_expense": table.total_expense + statement.excluded.total_expense,
+            "operations_count": table.operations_count + statement.excluded.operations_count,
+            "version": table.version + 1,
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+
+def record_operations(db: Session, operations: Iterable[Tuple[int, str, float]]):
+    """Добавляет операции к итогам филиалов в текущей транзакции синхронной сессии (без commit)"""
+    statement = upsert_statement(db.get_bind().dialect.name, operations)
+    if statement is not None:
+        db.execute(statement)
+
+def compute_totals(db: Session) -> Dict[int, Tuple[float, float, int]]:
+    """Итоги по филиалам, посчитанные заново по таблице операций и манифестам архива"""
+    rows = (
+        db.query(models.Operation.branch_id, *totals_columns())
+        .group_by(models.Operation.branch_id)
+        .all()
+    )
+    totals = {branch_id: (income, expense, count) for branch_id, income, expense, count in rows}
+    for branch_id, (income, expense, count) in archive.totals().items():
+        hot = totals.get(branch_id, (0.0, 0.0, 0))
+        totals[branch_id] = (hot[0] + income, hot[1] + expense, hot[2] + count)
+    return totals
+
+def verify(db: Session) -> List[dict]:
+    """Сравнивает branch_balances с операциями и возвращает список расхождений"""
+    expected = compute_totals(db)
+    stored = {
+        row.branch_id: (row.total_income, row.total_expense, row.operations_count)
+        for row in db.query(models.BranchBalance).all()
+    }
+    drift = []
+    for branch_id in sorted(set(expected) | set(stored)):
+        want = expected.get(branch_id, (0.0, 0.0, 0))
+        have = stored.get(branch_id, (0.0, 0.0, 0))
+        if (
+            not math.isclose(want[0], have[0], abs_tol=DRIFT_TOLERANCE)
+            or not math.isclose(want[1], have[1], abs_tol=DRIFT_TOLERANCE)
+            or want[2] != have[2]
+        ):
+            drift.append({"branch_id": branch_id, "expected": want, "stored": have})
+    return drift
+
+def rebuild(db: Session) -> int:
+    """Пересчитывает branch_balances по операциям одной транзакцией, возвращает число филиалов"""
+    if db.get_bind().dialect.name == "postgresql":
+        # Писатели ждут окончания пересчета и затем добавляют свои дельты к новым итогам
+        db.execute(text("LOCK TABLE branch_balances IN EXCLUSIVE MODE"))
+    totals = compute_totals(db)
+    # Версии продолжают расти: закэшированные клиентами ETag после пересчета не совпадут
+    versions = dict(db.query(models.BranchBalance.branch_id, models.BranchBalance.version).all())
+    db.execute(delete(models.BranchBalance))
+    # Филиалы без операций остаются с нулевыми итогами, чтобы не потерять их версию
+    for branch_id in versions:
+        totals.setdefault(branch_id, (0.0, 0.0, 0))
+    now = datetime.utcnow()
+    db.add_all(
+        models.BranchBalance(
+            branch_id=branch_id,
+            total_income=income,
+            total_expense=expense,
+            operations_count=count,
+            version=versions.get(branch_id, 0) + 1,
+            updated_at=now,
+        )
+        for branch_id, (income, expense, count) in totals.items()
+    )
+    db.commit()
+    return len(totals)
+
+def main(argv: List[str]) -> int:
+    from .database import SessionLocal
+
+    command = argv[0] if argv else "verify"
+    if command not in ("verify", "rebuild"):
+        print("Использование: python -m app.ledger [verify|rebuild]")
+        return 2
+
+    db = SessionLocal()
+    try:
+        if command == "rebuild":
+            print(f"✅ Итоги пересчитаны для филиалов: {rebuild(db)}")
+            return 0
+        drift = verify(db)
+        for item in drift:
+            print(f"❌ Филиал {item['branch_id']}: ожидалось {item['expected']}, "
+                  f"в таблице {item['stored']}")
+        if drift:
+            return 1
+        print("✅ Итоги филиалов совпадают с операциями")
+        return 0
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
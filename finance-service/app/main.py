@@ -1,23 +1,81 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, Query, Header
 from fastapi.security import HTTPBearer
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, tuple_, insert, select, update, or_
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from contextlib import asynccontextmanager, suppress
+from functools import partial
+from typing import List, Optional, Union
+from datetime import datetime, timezone
+import asyncio
 import os
 
-from . import models, schemas, auth_utils
-from .database import get_db, engine
-from .models import Base
+from . import (
+    models, schemas, auth_utils, pagination, ledger, timeseries, partitions, etag, feed,
+    idempotency, group_commit, fast_json, search, archive, stream_tickets
+)
+from .database import (
+    engine, async_engine, get_db, get_sync_db, init_db, pool_metrics, SessionLocal,
+    AsyncSessionLocal, read_router
+)
+
+# Применяем миграции при старте
+init_db()
+
+def maintain_partitions():
+    """Создает помесячные партиции operations на PARTITIONS_AHEAD месяцев вперед"""
+    try:
+        with engine.connect() as connection:
+            created = partitions.ensure_partitions(connection)
+        if created:
+            print(f"✅ Созданы партиции: {' '.join(created)}")
+    except Exception as error:
+        # Сервис продолжает работу: строки без партиции попадут в operations_default
+        print(f"⚠️  Обслуживание партиций не выполнено: {error}")
+
+def purge_idempotency_keys():
+    """Удаляет ключи идемпотентности с истекшим сроком"""
+    db = SessionLocal()
+    try:
+        idempotency.purge_expired(db)
+    except Exception as error:
+        print(f"⚠️  Очистка ключей идемпотентности не выполнена: {error}")
+    finally:
+        db.close()
 
-# Создаем таблицы при старте
-Base.metadata.create_all(bind=engine)
+async def maintenance_loop():
+    while True:
+        await asyncio.sleep(partitions.MAINTENANCE_INTERVAL_SECONDS)
+        await run_in_threadpool(maintain_partitions)
+        await run_in_threadpool(purge_idempotency_keys)
+
+# Пакетная запись одиночных POST /operations (FINANCE_GROUP_COMMIT=1)
+committer = group_commit.GroupCommitter(AsyncSessionLocal)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(maintain_partitions)
+    tasks = [asyncio.create_task(maintenance_loop())]
+    if async_engine.dialect.name == "postgresql":
+        # Новые операции других реплик приходят через LISTEN/NOTIFY
+        tasks.append(asyncio.create_task(feed.listen(async_engine, AsyncSessionLocal)))
+    if group_commit.ENABLED:
+        committer.start()
+    yield
+    await committer.stop()
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
 
 app = FastAPI(
     title="Finance Service",
     description="Сервис управления финансовыми операциями",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware - используем встроенный CORSMiddleware
@@ -30,20 +88,90 @@ app.add_middleware(
 )
 
 security = HTTPBearer()
+# Для SSE: EventSource в браузере не умеет передавать заголовки
+optional_security = HTTPBearer(auto_error=False)
+
+OPERATION_TYPES = ("income", "expense")
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Сколько строк читается из серверного курсора за один раз при потоковой выдаче
+STREAM_CHUNK_SIZE = int(os.getenv("FINANCE_STREAM_CHUNK_SIZE", "1000"))
 
-def get_current_user_data(credentials = Depends(security)):
+async def get_current_user_data(credentials = Depends(security)):
     token = credentials.credentials
     user_data = auth_utils.get_current_user(token)
     return user_data
 
+async def get_read_db(user_data: dict = Depends(get_current_user_data)):
+    """Сессия для GET-эндпоинтов: реплика, если она задана и пользователь недавно не писал"""
+    db = await read_router.session(user_data["user_id"])
+    try:
+        yield db
+    finally:
+        await db.close()
+
+async def get_stream_user_data(credentials = Depends(optional_security),
+                               ticket: Optional[str] = None):
+    """Пользователь из заголовка Authorization или одноразового билета ?ticket=
+    (app/stream_tickets.py)"""
+    if credentials is not None:
+        return auth_utils.get_current_user(credentials.credentials)
+    user_data = None
+    if ticket:
+        async with AsyncSessionLocal() as db:
+            user_data = await stream_tickets.redeem(db, ticket)
+    if user_data is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated"
+        )
+    return user_data
+
+async def _claim_idempotency_key(db: AsyncSession, user_id: int, key: str, fingerprint: str):
+    """Занимает ключ в текущей транзакции или возвращает сохраненный ответ для повтора"""
+    for _attempt in range(3):
+        now = datetime.utcnow()
+        stored = await db.get(models.IdempotencyKey, (user_id, key), populate_existing=True)
+        if stored is not None and stored.expires_at > now and stored.response_body is not None:
+            if stored.request_hash != fingerprint:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key уже использован с другим телом запроса"
+                )
+            return Response(
+                content=stored.response_body,
+                status_code=stored.status_code,
+                media_type="application/json",
+                headers={idempotency.REPLAYED_HEADER: "true"},
+            )
+        claimed = await db.scalar(
+            idempotency.claim_statement(db.bind.dialect.name, user_id, key, fingerprint, now)
+        )
+        if claimed is not None:
+            return None
+        # Ключ занят транзакцией, которая успела завершиться: перечитываем ее ответ
+        await db.rollback()
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Запрос с этим Idempotency-Key еще выполняется"
+    )
+
 # Эндпоинты с проверкой прав
 @app.post("/operations", response_model=schemas.OperationResponse)
-def create_operation(
+async def create_operation(
     operation_data: schemas.OperationCreate,
     user_data: dict = Depends(get_current_user_data),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(
+        None, alias=idempotency.HEADER, max_length=idempotency.MAX_KEY_LENGTH
+    )
 ):
-    """Создание новой финансовой операции с проверкой прав"""
+    """Создание новой финансовой операции с проверкой прав.
+
+    С заголовком Idempotency-Key повтор запроса возвращает сохраненный ответ
+    (с заголовком Idempotent-Replayed: true) и не создает вторую операцию.
+    При FINANCE_GROUP_COMMIT=1 запросы без ключа записываются пакетами (app/group_commit.py).
+    """
     role = user_data.get('role')
     user_branch_id = user_data.get('branch_id')
     
@@ -62,6 +190,31 @@ def create_operation(
                 detail="Можно создавать операции только для своего филиала"
             )
     
+    # Как и в /operations/batch: строка с чужим типом не доходит до пакета группового commit
+    if operation_data.type not in OPERATION_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Тип операции должен быть income или expense"
+        )
+    
+    if idempotency_key is not None:
+        fingerprint = idempotency.request_hash(operation_data.model_dump())
+        replay = await _claim_idempotency_key(
+            db, user_data["user_id"], idempotency_key, fingerprint
+        )
+        if replay is not None:
+            return replay
+    
+    if committer.running and idempotency_key is None:
+        read_router.mark_write(user_data["user_id"])
+        return await committer.submit({
+            "type": operation_data.type,
+            "amount": operation_data.amount,
+            "description": operation_data.description,
+            "user_id": user_data["user_id"],
+            "branch_id": operation_data.branch_id,
+        })
+    
     # Создаем операцию
     db_operation = models.Operation(
         type=operation_data.type,
@@ -71,38 +224,564 @@ def create_operation(
         branch_id=operation_data.branch_id
     )
     
+    dialect_name = db.bind.dialect.name
     db.add(db_operation)
-    db.commit()
-    db.refresh(db_operation)
+    await db.flush()
+    await db.execute(ledger.upsert_statement(
+        dialect_name, [(db_operation.branch_id, db_operation.type, db_operation.amount)]
+    ))
+    for statement in feed.notify_statements(dialect_name, [db_operation.id]):
+        await db.execute(statement)
+    if idempotency_key is not None:
+        # Ответ сохраняется в транзакции операции: ключ без ответа снаружи не виден
+        await db.execute(
+            update(models.IdempotencyKey)
+            .where(
+                models.IdempotencyKey.user_id == user_data["user_id"],
+                models.IdempotencyKey.key == idempotency_key,
+            )
+            .values(
+                status_code=status.HTTP_200_OK,
+                response_body=(
+                    schemas.OperationResponse.model_validate(db_operation).model_dump_json()
+                ),
+            )
+        )
+    await db.commit()
+    read_router.mark_write(user_data["user_id"])
+    await db.refresh(db_operation)
+    feed.publish_committed(dialect_name, [db_operation])
     
     return db_operation
 
-@app.get("/operations", response_model=List[schemas.OperationResponse])
-def get_operations(
+@app.post("/operations/batch", response_model=schemas.OperationBatchResponse)
+def create_operations_batch(
+    batch: schemas.OperationBatchCreate,
     user_data: dict = Depends(get_current_user_data),
-    db: Session = Depends(get_db),
-    branch_id: int = None
+    db: Session = Depends(get_sync_db)
 ):
-    """Получение списка операций с учетом прав доступа"""
+    """Пакетное создание операций одной транзакцией.
+
+    Строки, не прошедшие проверку, не прерывают пакет: они попадают в errors
+    с индексом строки, а в ids на их месте стоит null.
+    """
+    role = user_data.get('role')
+    user_branch_id = user_data.get('branch_id')
+    
+    # Руководители не могут создавать операции
+    if role == 'manager':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Руководители не могут создавать операции"
+        )
+    
+    rows = []
+    positions = []
+    errors = []
+    for index, operation_data in enumerate(batch.operations):
+        if operation_data.type not in OPERATION_TYPES:
+            errors.append({"index": index, "detail": "Тип операции должен быть income или expense"})
+            continue
+        # Бухгалтеры могут создавать операции только для своего филиала
+        if role == 'accountant' and operation_data.branch_id != user_branch_id:
+            errors.append({
+                "index": index, "detail": "Можно создавать операции только для своего филиала"
+            })
+            continue
+        rows.append({
+            "type": operation_data.type,
+            "amount": operation_data.amount,
+            "description": operation_data.description,
+            "user_id": user_data["user_id"],
+            "branch_id": operation_data.branch_id,
+        })
+        positions.append(index)
+    
+    ids = [None] * len(batch.operations)
+    if rows:
+        # Многострочный INSERT ... RETURNING; порядок id совпадает с порядком строк
+        statement = insert(models.Operation).returning(
+            models.Operation.id, models.Operation.created_at, sort_by_parameter_order=True
+        )
+        inserted = db.execute(statement, rows).all()
+        ledger.record_operations(
+            db, ((row["branch_id"], row["type"], row["amount"]) for row in rows)
+        )
+        dialect_name = db.get_bind().dialect.name
+        new_ids = [new_id for new_id, _created_at in inserted]
+        for notify in feed.notify_statements(dialect_name, new_ids):
+            db.execute(notify)
+        db.commit()
+        read_router.mark_write(user_data["user_id"])
+        for row, (new_id, created_at) in zip(rows, inserted):
+            row.update(id=new_id, created_at=created_at)
+        feed.publish_committed(dialect_name, rows)
+        for index, (new_id, _created_at) in zip(positions, inserted):
+            ids[index] = new_id
+    
+    return {"inserted": len(rows), "ids": ids, "errors": errors}
+
+def _scoped_operations_select(user_data: dict, branch_id: int = None):
+    """Выборка операций, ограниченная правами пользователя"""
     role = user_data.get('role')
     user_branch_id = user_data.get('branch_id')
     
+    statement = select(models.Operation)
     # Бухгалтер - только операции своего филиала
     if role == 'accountant':
-        query = db.query(models.Operation).filter(models.Operation.branch_id == user_branch_id)
+        statement = statement.where(models.Operation.branch_id == user_branch_id)
+    # Админ и руководитель - все операции
+    elif branch_id:
+        statement = statement.where(models.Operation.branch_id == branch_id)
+    return statement
+
+def _visible_branches(user_data: dict, branch_id: int = None) -> Optional[List[int]]:
+    """Филиалы, данные которых попадают в ответ (None - все филиалы)"""
+    if user_data.get('role') == 'accountant':
+        return [user_data.get('branch_id')]
+    return [branch_id] if branch_id else None
+
+async def _data_etag(request: Request, db: AsyncSession, user_data: dict,
+                     branch_ids: Optional[List[int]]) -> str:
+    """ETag ответа: путь, область видимости пользователя, параметры запроса и версия данных.
+
+    Версия читается до выборки строк: если запись произойдет между ними,
+    ETag окажется старше данных и клиент просто получит их заново.
+    """
+    version = (await db.execute(etag.version_statement(branch_ids))).scalar()
+    if user_data.get('role') == 'accountant':
+        scope = f"branch:{user_data.get('branch_id')}"
     else:
-        # Админ и руководитель - все операции
-        query = db.query(models.Operation)
-        if branch_id:
-            query = query.filter(models.Operation.branch_id == branch_id)
+        scope = "all"
+    variant = "ndjson" if NDJSON_MEDIA_TYPE in request.headers.get("accept", "") else "json"
+    return etag.make_etag(
+        f"{request.url.path}|{scope}|{variant}", request.query_params.multi_items(), version
+    )
+
+def _not_modified(tag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag.cache_headers(tag))
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Дата со смещением (например, ...Z) - в наивный UTC, как хранится created_at"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _check_filter_ranges(date_from: datetime = None, date_to: datetime = None,
+                         min_amount: float = None, max_amount: float = None):
+    """Приводит период к наивному UTC и отвечает 400 для пустых диапазонов фильтров.
+
+    Возвращает (date_from, date_to): дальше и SQL, и архив используют только их.
+    """
+    date_from, date_to = _naive_utc(date_from), _naive_utc(date_to)
+    if date_from and date_to and date_from >= date_to:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="date_from должен быть раньше date_to"
+        )
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="min_amount не может быть больше max_amount"
+        )
+    return date_from, date_to
+
+def _filter_operations(statement, date_from: datetime = None, date_to: datetime = None,
+                       operation_type: str = None, min_amount: float = None,
+                       max_amount: float = None, user_id: int = None):
+    """Фильтры по периоду [date_from, date_to), типу, диапазону суммы [min_amount, max_amount]
+    и автору.
+
+    Период сужает чтение до нужных партиций и диапазона индексов по created_at.
+    """
+    if date_from is not None:
+        statement = statement.where(models.Operation.created_at >= date_from)
+    if date_to is not None:
+        statement = statement.where(models.Operation.created_at < date_to)
+    if operation_type is not None:
+        statement = statement.where(models.Operation.type == operation_type)
+    if min_amount is not None:
+        statement = statement.where(models.Operation.amount >= min_amount)
+    if max_amount is not None:
+        statement = statement.where(models.Operation.amount <= max_amount)
+    if user_id is not None:
+        statement = statement.where(models.Operation.user_id == user_id)
+    return statement
+
+async def _read_archive(user_data: dict, branch_id: Optional[int], names,
+                        limit: Optional[int] = None, **filters):
+    """Строки архива (app/archive.py) с теми же правами и фильтрами, в виде строк SQL-запроса.
+
+    Асинхронный генератор порций: файлы читаются в threadpool месяц за месяцем.
+    """
+    if limit == 0 or not archive.catalog():
+        return
+    batches = archive.iter_operations(_visible_branches(user_data, branch_id), limit, **filters)
+    async for operations in iterate_in_threadpool(batches):
+        yield archive.as_rows(operations, names)
+
+async def _stream_list(rows: list, archive_batches, fields=fast_json.OPERATION_FIELDS):
+    """JSON-массив горячих строк и порций архива; архив не собирается в памяти целиком"""
+    yield b"["
+    separator = b""
+    if rows:
+        yield fast_json.encode_list_items(rows, fields)
+        separator = b","
+    async for batch in archive_batches:
+        yield separator + fast_json.encode_list_items(batch, fields)
+        separator = b","
+    yield b"]"
+
+async def _stream_operations(statement, user_id: int, fields=fast_json.OPERATION_FIELDS,
+                             limit: Optional[int] = None, read_archive=None):
+    """Отдает операции построчно в NDJSON, читая их серверным курсором порциями.
+
+    Использует собственную сессию: она должна жить, пока идет отправка ответа.
+    После горячих строк дочитывает архив через read_archive(limit), если он передан.
+    """
+    sent = 0
+    async with await read_router.session(user_id) as db:
+        result = await db.stream(statement.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        async for partition in result.partitions():
+            sent += len(partition)
+            yield fast_json.encode_ndjson(partition, fields)
+    if read_archive is not None:
+        async for rows in read_archive(None if limit is None else limit - sent):
+            yield fast_json.encode_ndjson(rows, fields)
+
+@app.get("/operations",
+         response_model=Union[List[schemas.OperationResponse], schemas.OperationPage])
+async def get_operations(
+    request: Request,
+    user_data: dict = Depends(get_current_user_data),
+    db: AsyncSession = Depends(get_read_db),
+    branch_id: int = None,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    since_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    operation_type: Optional[str] = Query(None, alias="type"),
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    user_id: Optional[int] = None,
+    q: Optional[str] = Query(None, min_length=1, max_length=search.MAX_QUERY_LENGTH)
+):
+    """Получение списка операций с учетом прав доступа.
+
+    Без limit/cursor возвращает весь список. С limit или cursor возвращает
+    страницу {items, next_cursor} в порядке (created_at, id) по убыванию.
+    С заголовком Accept: application/x-ndjson операции передаются потоком,
+    по одной на строку; cursor задает начало потока, limit - его длину.
+    Ответ несет ETag; If-None-Match с тем же значением дает 304 без чтения операций.
+    since_id оставляет только операции с id больше указанного. Это фильтр по id,
+    а не точка возобновления: операция с меньшим id, закоммиченная позже, в него
+    не попадет. Возобновлять ленту нужно через /operations/stream (Last-Event-ID),
+    где повтор идет с перекрытием.
+    
+    Строки читаются кортежами колонок и кодируются в JSON без ORM (app/fast_json.py).
+    fields=id,amount,type оставляет в SELECT и в ответе только эти поля.
+    
+    Фильтры date_from/date_to (date_to не включается), type, min_amount/max_amount
+    и user_id применяются в SQL поверх ограничений роли.
+    
+    q - поиск по описанию (app/search.py); выдача идет по убыванию релевантности,
+    курсор страницы учитывает ее. Архив поиском не охвачен: если диапазон дат
+    задевает архивные месяцы, запрос с q отклоняется с 400.
     
-    operations = query.order_by(models.Operation.created_at.desc()).all()
+    Операции закрытых месяцев, перенесенные в архив (app/archive.py), идут после
+    строк таблицы: они старше любой из них.
+    """
+    date_from, date_to = _check_filter_ranges(date_from, date_to, min_amount, max_amount)
+    try:
+        selected = fast_json.parse_fields(fields)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестные поля: {error}. Допустимые: {', '.join(fast_json.OPERATION_FIELDS)}"
+        )
+    # created_at и id нужны для курсора следующей страницы, даже если их нет в fields
+    columns = fast_json.operation_columns(selected, extra=("created_at", "id"))
+    names = fast_json.operation_column_names(
+        selected, extra=("created_at", "id", "rank") if q else ("created_at", "id")
+    )
+    if q:
+        archived = archive.archived_months(date_from, date_to)
+        if archived:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Поиск по описанию не охватывает архив: укажите date_from не раньше "
+                       f"{partitions.add_months(archived[-1], 1).isoformat()}"
+            )
+    archive_filters = dict(
+        since_id=since_id, date_from=date_from, date_to=date_to, operation_type=operation_type,
+        min_amount=min_amount, max_amount=max_amount, user_id=user_id,
+    )
+    statement = _scoped_operations_select(user_data, branch_id).with_only_columns(*columns)
+    # id как второй ключ делает порядок стабильным при одинаковом created_at
+    position_key = (models.Operation.created_at, models.Operation.id)
+    decode_cursor = pagination.decode_cursor
+    if q:
+        dialect_name = db.bind.dialect.name
+        rank = search.rank_expression(dialect_name, q)
+        # Релевантность - последняя колонка строки, в ответ она не попадает
+        statement = (
+            statement.where(search.match_condition(dialect_name, q)).add_columns(rank.label("rank"))
+        )
+        position_key = (rank, *position_key)
+        decode_cursor = pagination.decode_search_cursor
+    statement = statement.order_by(*(column.desc() for column in position_key))
+    
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Некорректный курсор"
+            )
+        statement = statement.where(tuple_(*position_key) < position)
+        # С q диапазон не задевает архив, курсор поиска ему не нужен
+        if not q:
+            archive_filters["before"] = position
+    if since_id is not None:
+        statement = statement.where(models.Operation.id > since_id)
+    statement = _filter_operations(
+        statement, date_from, date_to, operation_type, min_amount, max_amount, user_id
+    )
+    
+    tag = await _data_etag(request, db, user_data, _visible_branches(user_data, branch_id))
+    if etag.if_none_match(request.headers.get("if-none-match"), tag):
+        return _not_modified(tag)
+    
+    def read_archive(count: Optional[int] = None):
+        return _read_archive(user_data, branch_id, names, count, **archive_filters)
+    
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        if limit is not None:
+            statement = statement.limit(limit)
+        return StreamingResponse(
+            _stream_operations(statement, user_data["user_id"], selected, limit, read_archive),
+            media_type=NDJSON_MEDIA_TYPE, headers=etag.cache_headers(tag)
+        )
+    
+    if limit is None and cursor is None:
+        rows = (await db.execute(statement)).all()
+        if archive.catalog():
+            return StreamingResponse(_stream_list(rows, read_archive(), selected),
+                                     media_type="application/json", headers=etag.cache_headers(tag))
+        return Response(content=fast_json.encode_list(rows, selected),
+                        media_type="application/json", headers=etag.cache_headers(tag))
+    
+    # Берем одну лишнюю строку, чтобы узнать, есть ли следующая страница
+    page_size = pagination.clamp_page_size(limit)
+    rows = (await db.execute(statement.limit(page_size + 1))).all()
+    if len(rows) <= page_size:
+        async for batch in read_archive(page_size + 1 - len(rows)):
+            rows.extend(batch)
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        if q:
+            next_cursor = pagination.encode_search_cursor(last.rank, last.created_at, last.id)
+        else:
+            next_cursor = pagination.encode_cursor(last.created_at, last.id)
+    
+    return Response(content=fast_json.encode_page(rows, next_cursor, selected),
+                    media_type="application/json", headers=etag.cache_headers(tag))
+
+async def _replay_operations(db: AsyncSession, user_data: dict, branch_id: Optional[int],
+                             last_event_id: int) -> Optional[list]:
+    """Операции, которые клиент мог пропустить после last_event_id;
+    None, если их больше feed.REPLAY_LIMIT.
+
+    Кроме id > last_event_id повторяются операции, созданные не раньше чем за
+    feed.REPLAY_OVERLAP до операции last_event_id: строка с меньшим id могла
+    закоммититься после нее. Повторы клиент отбрасывает по id.
+    """
+    condition = models.Operation.id > last_event_id
+    anchor = await db.scalar(
+        select(models.Operation.created_at).where(models.Operation.id == last_event_id)
+    )
+    if anchor is not None:
+        condition = or_(condition, models.Operation.created_at >= anchor - feed.REPLAY_OVERLAP)
+    statement = (
+        _scoped_operations_select(user_data, branch_id)
+        .where(condition)
+        .order_by(models.Operation.id)
+        .limit(feed.REPLAY_LIMIT + 1)
+    )
+    operations = (await db.scalars(statement)).all()
+    if len(operations) > feed.REPLAY_LIMIT:
+        return None
     return operations
 
+async def _operation_events(request: Request, subscriber: feed.Subscriber, replay=None):
+    """События SSE: сначала пропущенные операции из базы, затем новые из ленты.
+
+    replay(db) возвращает пропущенные операции или None, если их слишком много:
+    тогда клиент получает reset и перезагружает список сам.
+    """
+    try:
+        yield f"retry: {feed.RETRY_MS}\n\n"
+        replayed = set()
+        if replay is not None:
+            async with AsyncSessionLocal() as db:
+                operations = await replay(db)
+            if operations is None:
+                yield feed.RESET_EVENT
+                return
+            for operation in operations:
+                operation_id, frame = feed.format_event(operation)
+                replayed.add(operation_id)
+                yield frame
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), feed.HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            # None - подписчик не успевал читать и отключен; клиент переподключится с Last-Event-ID
+            if event is None:
+                break
+            operation_id, frame = event
+            if operation_id not in replayed:
+                yield frame
+    finally:
+        feed.hub.unsubscribe(subscriber)
+
+@app.post("/operations/stream/ticket", response_model=schemas.StreamTicketResponse)
+async def create_stream_ticket(
+    user_data: dict = Depends(get_current_user_data),
+    db: AsyncSession = Depends(get_db)
+):
+    """Одноразовый билет для EventSource: GET /operations/stream?ticket=... вместо JWT в адресе"""
+    ticket = await stream_tickets.issue(db, user_data)
+    return {"ticket": ticket, "expires_in": int(stream_tickets.TTL.total_seconds())}
+
+@app.get("/operations/stream")
+async def stream_operations(
+    request: Request,
+    user_data: dict = Depends(get_stream_user_data),
+    branch_id: int = None,
+    since_id: Optional[int] = None
+):
+    """Лента новых операций (text/event-stream) с учетом прав доступа.
+
+    Каждое событие - operation с id операции и ее JSON. При переподключении
+    браузер присылает Last-Event-ID (или клиент передает since_id), и сначала
+    отдаются пропущенные операции с перекрытием (app/feed.py): повторы по id
+    клиент отбрасывает. Если пропущено больше FINANCE_STREAM_REPLAY_LIMIT
+    операций, приходит событие reset и поток закрывается: клиент загружает
+    список заново и подключается без since_id.
+    
+    Токен передается заголовком Authorization; браузерный EventSource вместо
+    него передает одноразовый ?ticket= из POST /operations/stream/ticket.
+    """
+    last_event_id = request.headers.get("last-event-id") or since_id
+    try:
+        last_event_id = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный Last-Event-ID"
+        )
+    
+    visible = _visible_branches(user_data, branch_id)
+    # Подписка до чтения пропущенных операций: ничего не теряется между ними
+    subscriber = feed.hub.subscribe(visible[0] if visible else None)
+    replay = None
+    if last_event_id is not None:
+        replay = partial(_replay_operations, user_data=user_data, branch_id=branch_id,
+                         last_event_id=last_event_id)
+    return StreamingResponse(
+        _operation_events(request, subscriber, replay),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _timeseries_select(dialect_name: str, user_data: dict, interval: str,
+                       branch_ids: List[int] = None, date_from: datetime = None,
+                       date_to: datetime = None, operation_type: str = None):
+    """Доходы, расходы и число операций по периодам, с теми же правами что и у списка операций"""
+    bucket = timeseries.bucket_expression(dialect_name, interval).label("bucket")
+    statement = _scoped_operations_select(user_data).with_only_columns(
+        bucket, *ledger.totals_columns()
+    )
+    if branch_ids and user_data.get('role') != 'accountant':
+        statement = statement.where(models.Operation.branch_id.in_(branch_ids))
+    statement = _filter_operations(statement, date_from, date_to, operation_type)
+    return statement.group_by(bucket).order_by(bucket)
+
+def _branch_totals_select(user_data: dict, branch_ids: List[int] = None, date_from: datetime = None,
+                          date_to: datetime = None, operation_type: str = None):
+    """Доходы, расходы и число операций по филиалам за период и тип, по таблице operations"""
+    statement = _scoped_operations_select(user_data).with_only_columns(
+        models.Operation.branch_id, *ledger.totals_columns()
+    )
+    if branch_ids:
+        statement = statement.where(models.Operation.branch_id.in_(branch_ids))
+    statement = _filter_operations(statement, date_from, date_to, operation_type)
+    return statement.group_by(models.Operation.branch_id)
+
+@app.get("/operations/timeseries", response_model=List[schemas.TimeSeriesPoint])
+async def get_operations_timeseries(
+    user_data: dict = Depends(get_current_user_data),
+    db: AsyncSession = Depends(get_read_db),
+    interval: str = Query("day", pattern="^(" + "|".join(timeseries.INTERVALS) + ")$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    branch_ids: Optional[List[int]] = Query(None),
+    operation_type: Optional[str] = Query(None, alias="type")
+):
+    """Временной ряд доходов, расходов и числа операций по дням, неделям или месяцам.
+
+    Периоды без операций не возвращаются. date_to не включается в диапазон.
+    Бухгалтер видит только свой филиал, как и в GET /operations; чужой филиал
+    в branch_ids дает 403, как в /balance/branches.
+    Периоды, перенесенные в архив (app/archive.py), считаются по его файлам.
+    """
+    date_from, date_to = _check_filter_ranges(date_from, date_to)
+    if user_data.get('role') == 'accountant':
+        if branch_ids and any(b != user_data.get('branch_id') for b in branch_ids):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Доступ запрещен к этому филиалу"
+            )
+    statement = _timeseries_select(
+        db.bind.dialect.name, user_data, interval, branch_ids, date_from, date_to, operation_type
+    )
+    rows = (await db.execute(statement)).all()
+    if archive.catalog():
+        if user_data.get('role') == 'accountant':
+            scope = [user_data.get('branch_id')]
+        else:
+            scope = branch_ids or None
+        buckets = await run_in_threadpool(
+            archive.timeseries, scope, interval,
+            date_from=date_from, date_to=date_to, operation_type=operation_type
+        )
+        # Неделя на границе архива может быть и в файлах, и в таблице: суммируем
+        for bucket, income, expense, count in rows:
+            values = buckets[bucket]
+            values[0] += income
+            values[1] += expense
+            values[2] += count
+        rows = [(bucket, *buckets[bucket]) for bucket in sorted(buckets)]
+    return [
+        {"bucket": bucket, "income": income, "expense": expense, "count": count}
+        for bucket, income, expense, count in rows
+    ]
+
 @app.get("/balance", response_model=schemas.BalanceResponse)
-def get_balance(
+async def get_balance(
+    request: Request,
+    response: Response,
     user_data: dict = Depends(get_current_user_data),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     branch_id: int = None
 ):
     """Получение баланса с учетом прав доступа"""
@@ -118,20 +797,23 @@ def get_balance(
             )
         # Если branch_id не указан, используем филиал бухгалтера
         actual_branch_id = branch_id or user_branch_id
-        query = db.query(models.Operation).filter(models.Operation.branch_id == actual_branch_id)
     else:
         # Админ и руководитель - любой баланс
-        query = db.query(models.Operation)
-        if branch_id:
-            query = query.filter(models.Operation.branch_id == branch_id)
-    
-    # Считаем доходы и расходы
-    income_result = query.filter(models.Operation.type == "income").with_entities(func.sum(models.Operation.amount)).scalar()
-    total_income = income_result if income_result else 0.0
+        actual_branch_id = branch_id
     
-    expense_result = query.filter(models.Operation.type == "expense").with_entities(func.sum(models.Operation.amount)).scalar()
-    total_expense = expense_result if expense_result else 0.0
+    tag = await _data_etag(request, db, user_data, [actual_branch_id] if actual_branch_id else None)
+    if etag.if_none_match(request.headers.get("if-none-match"), tag):
+        return _not_modified(tag)
+    response.headers.update(etag.cache_headers(tag))
     
+    # Итоги читаются из branch_balances, а не считаются по всей истории операций
+    statement = select(
+        func.coalesce(func.sum(models.BranchBalance.total_income), 0.0),
+        func.coalesce(func.sum(models.BranchBalance.total_expense), 0.0),
+    )
+    if actual_branch_id:
+        statement = statement.where(models.BranchBalance.branch_id == actual_branch_id)
+    total_income, total_expense = (await db.execute(statement)).one()
     total_balance = total_income - total_expense
     
     return {
@@ -141,10 +823,90 @@ def get_balance(
         "branch_id": branch_id or 0
     }
 
+@app.get("/balance/branches", response_model=List[schemas.BranchBalanceResponse])
+async def get_branch_balances(
+    request: Request,
+    response: Response,
+    user_data: dict = Depends(get_current_user_data),
+    db: AsyncSession = Depends(get_read_db),
+    branch_ids: Optional[List[int]] = Query(None),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    operation_type: Optional[str] = Query(None, alias="type")
+):
+    """Доходы, расходы, баланс и число операций по каждому филиалу из branch_balances.
+
+    Без branch_ids администратор и руководитель получают все филиалы,
+    бухгалтер - только свой.
+    С date_from/date_to (date_to не включается) или type итоги считаются по
+    операциям за этот период одним GROUP BY branch_id, вместе с архивом
+    (app/archive.py); филиалы без подходящих операций не возвращаются.
+    """
+    date_from, date_to = _check_filter_ranges(date_from, date_to)
+    role = user_data.get('role')
+    user_branch_id = user_data.get('branch_id')
+    
+    if role == 'accountant':
+        if branch_ids and any(b != user_branch_id for b in branch_ids):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Доступ запрещен к этому филиалу"
+            )
+        branch_ids = [user_branch_id]
+    
+    tag = await _data_etag(request, db, user_data, branch_ids or None)
+    if etag.if_none_match(request.headers.get("if-none-match"), tag):
+        return _not_modified(tag)
+    response.headers.update(etag.cache_headers(tag))
+    
+    if date_from is not None or date_to is not None or operation_type is not None:
+        totals = await run_in_threadpool(
+            archive.branch_totals, branch_ids or None,
+            date_from=date_from, date_to=date_to, operation_type=operation_type
+        )
+        statement = _branch_totals_select(user_data, branch_ids, date_from, date_to, operation_type)
+        for branch_id, income, expense, count in (await db.execute(statement)).all():
+            values = totals[branch_id]
+            values[0] += income
+            values[1] += expense
+            values[2] += count
+        rows = [(branch_id, *totals[branch_id]) for branch_id in sorted(totals)]
+    else:
+        statement = select(models.BranchBalance).where(models.BranchBalance.operations_count > 0)
+        if branch_ids:
+            statement = statement.where(models.BranchBalance.branch_id.in_(branch_ids))
+        balances = (await db.scalars(statement.order_by(models.BranchBalance.branch_id))).all()
+        rows = [(row.branch_id, row.total_income, row.total_expense, row.operations_count)
+                for row in balances]
+    
+    return [
+        {
+            "branch_id": branch_id,
+            "total_income": income,
+            "total_expense": expense,
+            "total_balance": income - expense,
+            "count": count
+        }
+        for branch_id, income, expense, count in rows
+        if count
+    ]
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "service": "finance-service"}
 
+@app.get("/metrics")
+def metrics():
+    """Метрики пула соединений для подбора POOL_SIZE / MAX_OVERFLOW, ленты, группового commit,
+    чтения с реплики и кэша токенов"""
+    return {
+        "db_pool": pool_metrics(),
+        "feed": feed.hub.stats(),
+        "group_commit": committer.stats(),
+        "read_routing": read_router.stats(),
+        "token_cache": auth_utils.token_cache.stats(),
+    }
+
 if __name__ == "__main__":
     import uvicorn
     print("🚀 Запуск Finance Service с исправленным CORS...")
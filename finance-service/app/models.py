@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, Text, Index
 from .database import Base
 from datetime import datetime
 
@@ -11,7 +11,69 @@ class Operation(Base):
     description = Column(Text)
     user_id = Column(Integer, nullable=False)
     branch_id = Column(Integer, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Ключ секционирования: на PostgreSQL таблица разбита на помесячные партиции
+    # (migrations/versions/0003_partition_operations.py), первичный ключ там (id, created_at)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Индексы под основные выборки (см. migrations/versions/0002_operation_indexes.py и 0006)
+    __table_args__ = (
+        Index("ix_operations_branch_created", "branch_id", "created_at", "id"),
+        Index("ix_operations_created", "created_at", "id"),
+        Index("ix_operations_branch_type_created", "branch_id", "type", "created_at"),
+        Index("ix_operations_user_created", "user_id", "created_at"),
+    )
+    
+    def __repr__(self):
+        return f"<Operation(id={self.id}, type={self.type}, amount={self.amount})>"
+
+class BranchBalance(Base):
+    """Итоги по филиалу, обновляются в той же транзакции, что и вставка операций"""
+    __tablename__ = "branch_balances"
+    
+    branch_id = Column(Integer, primary_key=True)
+    total_income = Column(Float, nullable=False, default=0.0)
+    total_expense = Column(Float, nullable=False, default=0.0)
+    operations_count = Column(Integer, nullable=False, default=0)
+    # Растет при каждой записи операций филиала, из нее строится ETag ответов
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return (f"<BranchBalance(branch_id={self.branch_id}, income={self.total_income}, "
+                f"expense={self.total_expense})>")
+
+class IdempotencyKey(Base):
+    """Результат POST /operations, сохраненный под ключом Idempotency-Key клиента"""
+    __tablename__ = "idempotency_keys"
+    
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    response_body = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires", "expires_at"),
+    )
+    
+    def __repr__(self):
+        return f"<IdempotencyKey(user_id={self.user_id}, key={self.key})>"
+
+class StreamTicket(Base):
+    """Одноразовый билет подключения к /operations/stream (app/stream_tickets.py)"""
+    __tablename__ = "stream_tickets"
+    
+    ticket_hash = Column(String(64), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    role = Column(String(50))
+    branch_id = Column(Integer)
+    expires_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_stream_tickets_expires", "expires_at"),
+    )
     
     def __repr__(self):
-        return f"<Operation(id={self.id}, type={self.type}, amount={self.amount})>"
\ No newline at end of file
+        return f"<StreamTicket(user_id={self.user_id}, expires_at={self.expires_at})>"
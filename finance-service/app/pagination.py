@@ -0,0 +1,43 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+# Размер страницы по умолчанию и верхняя граница для параметра limit
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    """Приводит запрошенный размер страницы к допустимому диапазону"""
+    if not limit:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+def encode_cursor(created_at: datetime, operation_id: int) -> str:
+    """Кодирует позицию (created_at, id) последней строки страницы в непрозрачный курсор"""
+    raw = json.dumps([created_at.isoformat(), operation_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """Декодирует курсор, возвращает None если курсор поврежден"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, operation_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(created_at), int(operation_id)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+def encode_search_cursor(rank: float, created_at: datetime, operation_id: int) -> str:
+    """Курсор выдачи поиска: позиция (rank, created_at, id) последней строки"""
+    raw = json.dumps([rank, created_at.isoformat(), operation_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_search_cursor(cursor: str) -> Optional[Tuple[float, datetime, int]]:
+    """Декодирует курсор поиска, возвращает None если курсор поврежден"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        decoded = base64.urlsafe_b64decode(padded.encode("ascii"))
+        rank, created_at, operation_id = json.loads(decoded)
+        return float(rank), datetime.fromisoformat(created_at), int(operation_id)
+    except (ValueError, TypeError, UnicodeError):
+        return None
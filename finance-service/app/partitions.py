@@ -0,0 +1,117 @@
+"""
+Помесячные партиции таблицы operations (PostgreSQL, PARTITION BY RANGE (created_at)).
+
+Партиции создаются заранее: при старте сервиса и затем раз в сутки на
+PARTITIONS_AHEAD месяцев вперед. Строки вне созданных диапазонов попадают
+в operations_default. Обслуживание вручную:
+
+    python -m app.partitions list
+    python -m app.partitions ensure [YYYY-MM]   # создать партиции с указанного месяца
+    python -m app.partitions detach YYYY-MM     # отсоединить месяц (затем архив/DROP)
+"""
+import os
+import sys
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+PARENT_TABLE = "operations"
+DEFAULT_PARTITION = "operations_default"
+PARTITIONS_AHEAD = int(os.getenv("FINANCE_PARTITIONS_AHEAD", "3"))
+# Как часто сервис проверяет, что партиции впереди созданы
+MAINTENANCE_INTERVAL_SECONDS = 24 * 60 * 60
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+def is_partitioned(connection: Connection) -> bool:
+    """True, если operations в этой базе - секционированная таблица"""
+    if connection.dialect.name != "postgresql":
+        return False
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p')"),
+        {"name": PARENT_TABLE},
+    ).scalar()
+    return relkind == "p"
+
+def list_partitions(connection: Connection) -> List[str]:
+    return list(connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :name ORDER BY child.relname"
+    ), {"name": PARENT_TABLE}).scalars())
+
+def ensure_partitions(connection: Connection, start: Optional[date] = None,
+                      months_ahead: int = PARTITIONS_AHEAD) -> List[str]:
+    """Создает недостающие помесячные партиции от start (по умолчанию текущий месяц)
+    до months_ahead месяцев вперед. Возвращает имена созданных партиций."""
+    if not is_partitioned(connection):
+        return []
+    existing = set(list_partitions(connection))
+    first = month_start(start or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), months_ahead)
+    created = []
+    month = first
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            # Если в operations_default уже есть строки этого месяца, PostgreSQL
+            # откажет в создании партиции; такой месяц переносится вручную
+            try:
+                with connection.begin_nested():
+                    connection.execute(text(
+                        f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} "
+                        f"FOR VALUES FROM ('{month.isoformat()}') "
+                        f"TO ('{add_months(month, 1).isoformat()}')"
+                    ))
+                created.append(name)
+            except DBAPIError as error:
+                print(f"⚠️  Партиция {name} не создана: {error.orig}")
+        month = add_months(month, 1)
+    connection.commit()
+    return created
+
+def detach_partition(connection: Connection, month: date) -> str:
+    """Отсоединяет партицию месяца: она остается обычной таблицей для архивации или DROP"""
+    name = partition_name(month_start(month))
+    connection.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+    connection.commit()
+    return name
+
+def main(argv: List[str]) -> int:
+    from .database import engine
+
+    command = argv[0] if argv else "list"
+    with engine.connect() as connection:
+        if not is_partitioned(connection):
+            print("ℹ️  Таблица operations не секционирована (нужен PostgreSQL и миграция 0003)")
+            return 1
+        if command == "list":
+            for name in list_partitions(connection):
+                print(name)
+            return 0
+        if command == "ensure":
+            start = datetime.strptime(argv[1], "%Y-%m").date() if len(argv) > 1 else None
+            created = ensure_partitions(connection, start=start)
+            print(f"✅ Создано партиций: {len(created)} {' '.join(created)}")
+            return 0
+        if command == "detach" and len(argv) > 1:
+            name = detach_partition(connection, datetime.strptime(argv[1], "%Y-%m").date())
+            print(f"✅ Партиция {name} отсоединена")
+            return 0
+    print("Использование: python -m app.partitions [list|ensure [YYYY-MM]|detach YYYY-MM]")
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,96 @@
+"""
+Маршрутизация чтения на реплику (FINANCE_READ_DATABASE_URL).
+
+GET-эндпоинты берут сессию через ReadRouter.session(user_id): она открыта
+к реплике, если реплика задана и доступна, иначе к основной базе. Запись
+всегда идет в основную базу.
+
+    FINANCE_READ_AFTER_WRITE_SECONDS    сколько секунд после своей записи пользователь
+                                        читает из основной базы (0 - не привязывать)
+    FINANCE_READ_REPLICA_RETRY_SECONDS  сколько секунд не обращаться к реплике после
+                                        ошибки подключения к ней
+
+Привязка после записи хранится в памяти процесса: при нескольких репликах
+сервиса она действует на той, что приняла запись.
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy.exc import DBAPIError
+
+READ_AFTER_WRITE_SECONDS = float(os.getenv("FINANCE_READ_AFTER_WRITE_SECONDS", "5"))
+REPLICA_RETRY_SECONDS = float(os.getenv("FINANCE_READ_REPLICA_RETRY_SECONDS", "30"))
+# При таком числе привязок устаревшие удаляются
+STICKY_PRUNE_SIZE = 10_000
+
+class ReadRouter:
+    """Выбор базы для чтения: реплика, основная база после своей записи или при сбое реплики"""
+
+    def __init__(self, primary_factory, replica_factory=None,
+                 read_after_write: float = READ_AFTER_WRITE_SECONDS,
+                 retry_after: float = REPLICA_RETRY_SECONDS):
+        self.primary_factory = primary_factory
+        self.replica_factory = replica_factory
+        self.read_after_write = read_after_write
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._sticky: Dict[int, float] = {}
+        self._replica_down_until = 0.0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.sticky_reads = 0
+        self.fallbacks = 0
+
+    def mark_write(self, user_id: int):
+        """Запоминает запись пользователя: его чтения ненадолго идут в основную базу"""
+        if self.replica_factory is None or self.read_after_write <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._sticky) >= STICKY_PRUNE_SIZE:
+                self._sticky = {key: until for key, until in self._sticky.items() if until > now}
+            self._sticky[user_id] = now + self.read_after_write
+
+    def _is_sticky(self, user_id: Optional[int], now: float) -> bool:
+        with self._lock:
+            until = self._sticky.get(user_id)
+            if until is None:
+                return False
+            if until <= now:
+                del self._sticky[user_id]
+                return False
+            return True
+
+    async def session(self, user_id: Optional[int] = None):
+        """Открытая сессия для чтения; закрывает вызывающий"""
+        now = time.monotonic()
+        if self.replica_factory is None or now < self._replica_down_until:
+            self.primary_reads += 1
+            return self.primary_factory()
+        if self._is_sticky(user_id, now):
+            self.sticky_reads += 1
+            return self.primary_factory()
+        db = self.replica_factory()
+        try:
+            # Соединение берется сразу, чтобы сбой реплики обнаружился до запроса
+            await db.connection()
+        except (DBAPIError, OSError) as error:
+            await db.close()
+            self._replica_down_until = time.monotonic() + self.retry_after
+            self.fallbacks += 1
+            print(f"⚠️  Реплика для чтения недоступна ({error}), чтение из основной базы")
+            return self.primary_factory()
+        self.replica_reads += 1
+        return db
+
+    def stats(self) -> dict:
+        return {
+            "replica": self.replica_factory is not None,
+            "replica_down": time.monotonic() < self._replica_down_until,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "sticky_reads": self.sticky_reads,
+            "fallbacks": self.fallbacks,
+        }
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, List
 from datetime import datetime
 
 class OperationCreate(BaseModel):
@@ -8,6 +8,18 @@ class OperationCreate(BaseModel):
     description: str
     branch_id: int
 
+class OperationBatchCreate(BaseModel):
+    operations: List[OperationCreate] = Field(..., min_length=1, max_length=10000)
+
+class OperationBatchError(BaseModel):
+    index: int
+    detail: str
+
+class OperationBatchResponse(BaseModel):
+    inserted: int
+    ids: List[Optional[int]]  # id созданной операции или None для отклоненной строки
+    errors: List[OperationBatchError]
+
 class OperationResponse(BaseModel):
     id: int
     type: str
@@ -20,8 +32,29 @@ class OperationResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class OperationPage(BaseModel):
+    items: List[OperationResponse]
+    next_cursor: Optional[str] = None
+
 class BalanceResponse(BaseModel):
     total_balance: float
     total_income: float
     total_expense: float
-    branch_id: int
\ No newline at end of file
+    branch_id: int
+
+class BranchBalanceResponse(BaseModel):
+    branch_id: int
+    total_income: float
+    total_expense: float
+    total_balance: float
+    count: int
+
+class TimeSeriesPoint(BaseModel):
+    bucket: datetime  # начало дня, недели (понедельник) или месяца
+    income: float
+    expense: float
+    count: int
+
+class StreamTicketResponse(BaseModel):
+    ticket: str
+    expires_in: int  # секунд до истечения билета
@@ -0,0 +1,36 @@
+"""
+Поиск операций по описанию (GET /operations?q=).
+
+На PostgreSQL запрос разбирается websearch_to_tsquery('russian', q) и
+сравнивается с колонкой search_vector под GIN-индексом (миграция 0007):
+"зарплаты" находит "Зарплата", работают кавычки, OR и минус. Результаты
+упорядочены по ts_rank_cd. На SQLite (разработка и тесты) - ILIKE по
+подстроке без ранжирования.
+"""
+from sqlalchemy import Float, func, literal, literal_column
+
+from . import models
+
+SEARCH_CONFIG = "russian"
+MAX_QUERY_LENGTH = 200
+
+def _ts_query(q: str):
+    return func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'"), q)
+
+def _escape_like(value: str) -> str:
+    """% и _ в запросе ищутся буквально, а не как шаблон LIKE"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def match_condition(dialect_name: str, q: str):
+    """Условие WHERE: описание операции соответствует запросу"""
+    if dialect_name == "postgresql":
+        return literal_column("operations.search_vector").op("@@")(_ts_query(q))
+    return models.Operation.description.ilike(f"%{_escape_like(q)}%", escape="\\")
+
+def rank_expression(dialect_name: str, q: str):
+    """Релевантность операции запросу (чем больше, тем выше в выдаче)"""
+    if dialect_name == "postgresql":
+        return func.ts_rank_cd(
+            literal_column("operations.search_vector"), _ts_query(q), type_=Float
+        )
+    return literal(0.0, type_=Float)
@@ -0,0 +1,54 @@
+"""
+Одноразовые билеты для подключения к GET /operations/stream.
+
+EventSource в браузере не умеет передавать заголовок Authorization, а JWT в
+адресе попал бы в журналы доступа, прокси и историю браузера на весь срок
+жизни токена. Поэтому клиент с токеном в заголовке получает билет через
+POST /operations/stream/ticket и передает в адресе его (?ticket=...). Билет
+действует FINANCE_STREAM_TICKET_SECONDS секунд и только на одно подключение:
+DELETE ... RETURNING гасит его атомарно, на любой реплике. В базе хранится
+только sha256 билета.
+"""
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+TTL = timedelta(seconds=int(os.getenv("FINANCE_STREAM_TICKET_SECONDS", "30")))
+
+def _digest(ticket: str) -> str:
+    return hashlib.sha256(ticket.encode("utf-8")).hexdigest()
+
+async def issue(db: AsyncSession, user_data: dict) -> str:
+    """Создает билет для пользователя из JWT и попутно удаляет просроченные"""
+    now = datetime.utcnow()
+    ticket = secrets.token_urlsafe(32)
+    await db.execute(delete(models.StreamTicket).where(models.StreamTicket.expires_at <= now))
+    db.add(models.StreamTicket(
+        ticket_hash=_digest(ticket),
+        user_id=user_data["user_id"],
+        role=user_data.get("role"),
+        branch_id=user_data.get("branch_id"),
+        expires_at=now + TTL,
+    ))
+    await db.commit()
+    return ticket
+
+async def redeem(db: AsyncSession, ticket: str) -> Optional[dict]:
+    """Гасит билет и возвращает данные пользователя; None, если билета нет или он истек"""
+    table = models.StreamTicket
+    row = (await db.execute(
+        delete(table)
+        .where(table.ticket_hash == _digest(ticket))
+        .returning(table.user_id, table.role, table.branch_id, table.expires_at)
+    )).first()
+    await db.commit()
+    if row is None or row.expires_at <= datetime.utcnow():
+        return None
+    return {"user_id": row.user_id, "role": row.role, "branch_id": row.branch_id}
@@ -0,0 +1,27 @@
+from sqlalchemy import DateTime, Integer, String, cast, func, literal, literal_column, type_coerce
+
+from . import models
+
+# Допустимые шаги временного ряда
+INTERVALS = ("day", "week", "month")
+
+def bucket_expression(dialect_name: str, interval: str):
+    """Начало периода (день, неделя с понедельника, месяц), в который попадает created_at"""
+    created_at = models.Operation.created_at
+    if interval not in INTERVALS:
+        raise ValueError(f"Неизвестный интервал: {interval}")
+    if dialect_name == "postgresql":
+        # Интервал подставляется литералом: одинаковое выражение в SELECT и GROUP BY
+        return func.date_trunc(literal_column(f"'{interval}'"), created_at)
+
+    # SQLite (локальная разработка и тесты): date_trunc нет, считаем через datetime()
+    if interval == "month":
+        expression = func.datetime(created_at, "start of month")
+    elif interval == "week":
+        # %w: 0 - воскресенье; сдвигаем на число дней, прошедших с понедельника
+        days_since_monday = (cast(func.strftime("%w", created_at), Integer) + 6) % 7
+        shift = literal("-") + cast(days_since_monday, String) + literal(" days")
+        expression = func.datetime(created_at, "start of day", shift)
+    else:
+        expression = func.datetime(created_at, "start of day")
+    return type_coerce(expression, DateTime)
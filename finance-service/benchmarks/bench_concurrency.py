@@ -0,0 +1,115 @@
+"""
+Нагрузочное сравнение режимов finance-service: requests/sec и p99 при 50/200/1000 клиентах.
+
+Запустите две копии сервиса на одной базе: текущую (асинхронный движок) и сборку
+до перехода на asyncpg (синхронные обработчики в threadpool), затем:
+
+    python benchmarks/bench_concurrency.py \
+        --target async=http://localhost:8001 --target threaded=http://localhost:8011
+
+Генератор нагрузки сам работает на asyncio; для 1000 клиентов лучше запускать
+его на отдельной машине, чтобы он не конкурировал с сервисом за CPU.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from jose import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.auth_utils import SECRET_KEY, ALGORITHM
+
+CONCURRENCY_LEVELS = (50, 200, 1000)
+BRANCH_ID = 1
+
+SCENARIOS = {
+    "list": ("GET", "/operations", {"params": {"limit": 50}}),
+    "balance": ("GET", "/balance", {}),
+    "create": ("POST", "/operations", {"json": {
+        "type": "income", "amount": 1.0, "description": "benchmark", "branch_id": BRANCH_ID
+    }}),
+}
+
+
+def auth_headers():
+    token = jwt.encode({"user_id": 1, "role": "accountant", "branch_id": BRANCH_ID},
+                       SECRET_KEY, algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_level(base_url, scenario, concurrency, duration):
+    """Держит concurrency параллельных клиентов duration секунд"""
+    method, path, kwargs = SCENARIOS[scenario]
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers=auth_headers(),
+                                 limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, **kwargs)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--target", action="append", required=True,
+                        help="имя=URL сервиса, можно несколько")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--concurrency", type=int, action="append")
+    parser.add_argument("--duration", type=float, default=15.0, help="секунд на каждый замер")
+    args = parser.parse_args()
+
+    targets = [target.split("=", 1) for target in args.target]
+    scenarios = args.scenario or sorted(SCENARIOS)
+    levels = args.concurrency or CONCURRENCY_LEVELS
+
+    print(f"{'scenario':<9} {'clients':>7} {'target':<10} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for scenario in scenarios:
+        for concurrency in levels:
+            for name, url in targets:
+                result = await run_level(url, scenario, concurrency, args.duration)
+                print(
+                    f"{scenario:<9} {concurrency:>7} {name:<10} {result['rps']:>9.1f} "
+                    f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>7}"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
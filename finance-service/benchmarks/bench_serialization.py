@@ -0,0 +1,106 @@
+"""
+CPU и память на сериализацию списка операций: ORM + OperationResponse против Core + orjson.
+
+Для каждого размера создается временная база SQLite с operations, затем оба пути
+читают все строки и кодируют их в JSON так же, как GET /operations:
+
+- orm:  select(Operation) -> ORM-объекты -> OperationResponse (from_attributes) -> json.dumps
+- core: select(колонки) -> кортежи -> fast_json.encode_list (orjson)
+
+Время - process_time (CPU процесса), память - пик tracemalloc в отдельном прогоне.
+
+    python benchmarks/bench_serialization.py --rows 10000 --rows 100000 --rows 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app import fast_json, models, schemas
+from app.database import Base
+
+ROW_COUNTS = (10_000, 100_000, 1_000_000)
+
+adapter = TypeAdapter(List[schemas.OperationResponse])
+
+
+def seed(engine, rows):
+    Base.metadata.create_all(engine, tables=[models.Operation.__table__])
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        for offset in range(0, rows, 50_000):
+            connection.execute(insert(models.Operation), [
+                {
+                    "type": "income" if n % 3 else "expense",
+                    "amount": (n % 1000) + 0.5,
+                    "description": f"Операция {n}",
+                    "user_id": n % 50 + 1,
+                    "branch_id": n % 100 + 1,
+                    "created_at": start + timedelta(minutes=n),
+                }
+                for n in range(offset, min(rows, offset + 50_000))
+            ])
+
+
+def orm_path(engine):
+    with Session(engine) as db:
+        operations = db.scalars(select(models.Operation)).all()
+        validated = adapter.validate_python(operations, from_attributes=True)
+        content = adapter.dump_python(validated, mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                          separators=(",", ":")).encode("utf-8")
+
+
+def core_path(engine):
+    with engine.connect() as connection:
+        rows = connection.execute(select(*fast_json.operation_columns())).all()
+        return fast_json.encode_list(rows)
+
+
+def measure(path, engine):
+    gc.collect()
+    started = time.process_time()
+    body = path(engine)
+    cpu = time.process_time() - started
+    del body
+    gc.collect()
+    tracemalloc.start()
+    path(engine)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, action="append")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'path':<5} {'cpu s':>8} {'peak MiB':>9} {'same bytes':>10}")
+    for rows in args.rows or ROW_COUNTS:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            seed(engine, rows)
+            same = orm_path(engine) == core_path(engine)
+            for name, path in (("orm", orm_path), ("core", core_path)):
+                cpu, peak = measure(path, engine)
+                print(f"{rows:>9} {name:<5} {cpu:>8.2f} {peak / 2**20:>9.1f} {str(same):>10}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
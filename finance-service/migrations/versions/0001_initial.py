@@ -0,0 +1,64 @@
+"""Начальная схема: operations и branch_balances
+
+Базы, созданные раньше через Base.metadata.create_all, принимаются как есть:
+существующие таблицы не пересоздаются.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if "operations" not in tables:
+        op.create_table(
+            "operations",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("type", sa.String(10), nullable=False),
+            sa.Column("amount", sa.Float(), nullable=False),
+            sa.Column("description", sa.Text()),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("branch_id", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime()),
+        )
+        op.create_index("ix_operations_id", "operations", ["id"])
+
+    if "branch_balances" not in tables:
+        op.create_table(
+            "branch_balances",
+            sa.Column("branch_id", sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column("total_income", sa.Float(), nullable=False),
+            sa.Column("total_expense", sa.Float(), nullable=False),
+            sa.Column("operations_count", sa.Integer(), nullable=False),
+            sa.Column("updated_at", sa.DateTime()),
+        )
+        # Итоги для уже накопленных операций
+        op.execute(
+            "INSERT INTO branch_balances "
+            "(branch_id, total_income, total_expense, operations_count, updated_at) "
+            "SELECT branch_id, "
+            "COALESCE(SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END), 0), "
+            "COALESCE(SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END), 0), "
+            "COUNT(id), CURRENT_TIMESTAMP "
+            "FROM operations GROUP BY branch_id"
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("branch_balances")
+    op.drop_index("ix_operations_id", table_name="operations")
+    op.drop_table("operations")
@@ -0,0 +1,45 @@
+"""Составные индексы под /operations, /balance и отчеты
+
+- (branch_id, created_at, id): список операций филиала и курсорная пагинация
+- (created_at, id): список всех операций для администратора и руководителя
+- (branch_id, type, created_at): выборки по типу операции и пересчет итогов
+
+В PostgreSQL индексы строятся CONCURRENTLY, чтобы не блокировать запись.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_operations_branch_created", ["branch_id", "created_at", "id"]),
+    ("ix_operations_created", ["created_at", "id"]),
+    ("ix_operations_branch_type_created", ["branch_id", "type", "created_at"]),
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES:
+                op.create_index(name, "operations", columns, if_not_exists=True,
+                                postgresql_concurrently=True)
+    else:
+        for name, columns in INDEXES:
+            op.create_index(name, "operations", columns, if_not_exists=True)
+
+
+def downgrade() -> None:
+    for name, _columns in INDEXES:
+        op.drop_index(name, table_name="operations")
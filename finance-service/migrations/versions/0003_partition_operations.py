@@ -0,0 +1,120 @@
+"""Секционирование operations по месяцам created_at (только PostgreSQL)
+
+Таблица пересоздается как PARTITION BY RANGE (created_at): по партиции на
+каждый месяц с данными и на несколько месяцев вперед, плюс operations_default.
+Существующие строки переносятся в этой же транзакции, id сохраняются.
+Первичный ключ становится (id, created_at), т.к. должен включать ключ секционирования.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16 00:00:00
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+INDEXES = [
+    ("ix_operations_id", "id"),
+    ("ix_operations_branch_created", "branch_id, created_at, id"),
+    ("ix_operations_created", "created_at, id"),
+    ("ix_operations_branch_type_created", "branch_id, type, created_at"),
+]
+
+COLUMNS = "id, type, amount, description, user_id, branch_id, created_at"
+
+
+def _add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    # Старая таблица освобождает имена индексов и последовательность
+    op.execute("ALTER TABLE operations RENAME TO operations_legacy")
+    op.execute("ALTER TABLE operations_legacy DROP CONSTRAINT operations_pkey")
+    for name, _columns in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("ALTER SEQUENCE operations_id_seq OWNED BY NONE")
+
+    op.execute(
+        "CREATE TABLE operations ("
+        " id integer NOT NULL DEFAULT nextval('operations_id_seq'),"
+        " type varchar(10) NOT NULL,"
+        " amount double precision NOT NULL,"
+        " description text,"
+        " user_id integer NOT NULL,"
+        " branch_id integer NOT NULL,"
+        " created_at timestamp without time zone NOT NULL,"
+        " PRIMARY KEY (id, created_at)"
+        ") PARTITION BY RANGE (created_at)"
+    )
+    op.execute("ALTER SEQUENCE operations_id_seq OWNED BY operations.id")
+
+    today = date.today()
+    first = bind.execute(sa.text("SELECT min(created_at) FROM operations_legacy")).scalar()
+    month = date(first.year, first.month, 1) if first else date(today.year, today.month, 1)
+    last = _add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        following = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE operations_y{month.year:04d}m{month.month:02d} PARTITION OF operations "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        )
+        month = following
+    op.execute("CREATE TABLE operations_default PARTITION OF operations DEFAULT")
+
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON operations ({columns})")
+
+    # Строки без created_at получают время миграции: ключ секционирования обязателен
+    op.execute(
+        f"INSERT INTO operations ({COLUMNS}) "
+        "SELECT id, type, amount, description, user_id, branch_id, "
+        "COALESCE(created_at, now() AT TIME ZONE 'utc') FROM operations_legacy"
+    )
+    op.execute("DROP TABLE operations_legacy")
+    op.execute("ANALYZE operations")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE operations RENAME TO operations_partitioned")
+    op.execute("ALTER TABLE operations_partitioned DROP CONSTRAINT operations_pkey")
+    for name, _columns in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute("ALTER SEQUENCE operations_id_seq OWNED BY NONE")
+
+    op.execute(
+        "CREATE TABLE operations ("
+        " id integer NOT NULL DEFAULT nextval('operations_id_seq') PRIMARY KEY,"
+        " type varchar(10) NOT NULL,"
+        " amount double precision NOT NULL,"
+        " description text,"
+        " user_id integer NOT NULL,"
+        " branch_id integer NOT NULL,"
+        " created_at timestamp without time zone"
+        ")"
+    )
+    op.execute("ALTER SEQUENCE operations_id_seq OWNED BY operations.id")
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON operations ({columns})")
+    op.execute(f"INSERT INTO operations ({COLUMNS}) SELECT {COLUMNS} FROM operations_partitioned")
+    op.execute("DROP TABLE operations_partitioned CASCADE")
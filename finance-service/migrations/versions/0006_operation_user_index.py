@@ -0,0 +1,41 @@
+"""Индекс (user_id, created_at) для фильтра GET /operations?user_id=
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-16 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NAME = "ix_operations_user_created"
+COLUMNS = ["user_id", "created_at"]
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    partitioned = bind.dialect.name == "postgresql" and bind.execute(sa.text(
+        "SELECT relkind FROM pg_class WHERE relname = 'operations'"
+    )).scalar() == "p"
+    if bind.dialect.name == "postgresql" and not partitioned:
+        with op.get_context().autocommit_block():
+            op.create_index(
+                NAME, "operations", COLUMNS, if_not_exists=True, postgresql_concurrently=True
+            )
+    else:
+        # Для секционированной таблицы CONCURRENTLY не поддерживается:
+        # индекс строится по партициям под блокировкой записи
+        op.create_index(NAME, "operations", COLUMNS, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index(NAME, table_name="operations")
@@ -0,0 +1,40 @@
+"""Полнотекстовый поиск по описанию операций (только PostgreSQL)
+
+Колонка search_vector вычисляется самой базой из description (словарь russian,
+со стеммингом) и индексируется GIN. В модели ее нет: приложение обращается к
+ней только в запросах с ?q= на PostgreSQL.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-16 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute(
+        "ALTER TABLE operations ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('russian', coalesce(description, ''))) STORED"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_operations_search ON operations USING gin (search_vector)"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("DROP INDEX IF EXISTS ix_operations_search")
+    op.execute("ALTER TABLE operations DROP COLUMN IF EXISTS search_vector")
@@ -0,0 +1,35 @@
+"""Одноразовые билеты для подключения к ленте операций
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-16 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stream_tickets",
+        sa.Column("ticket_hash", sa.String(64), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("role", sa.String(50)),
+        sa.Column("branch_id", sa.Integer()),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_stream_tickets_expires", "stream_tickets", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_stream_tickets_expires", table_name="stream_tickets")
+    op.drop_table("stream_tickets")
@@ -12,10 +12,28 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from fastapi.testclient import TestClient
 from app.main import app
 from app.schemas import OperationCreate
+from app import auth_utils
+from jose import jwt
+import uuid
 
 client = TestClient(app)
 
 
+def auth_headers(role='accountant', branch_id=1, user_id=1):
+    """Заголовок Authorization с токеном, подписанным тем же ключом что и в auth-service"""
+    token = jwt.encode(
+        {'user_id': user_id, 'role': role, 'branch_id': branch_id},
+        auth_utils.SECRET_KEY,
+        algorithm=auth_utils.ALGORITHM
+    )
+    return {'Authorization': f'Bearer {token}'}
+
+
+def new_branch_id():
+    """Уникальный филиал, чтобы тесты не зависели от данных предыдущих запусков"""
+    return uuid.uuid4().int % 1_000_000_000 + 1000
+
+
 def test_health_endpoint():
     """Тест проверки работоспособности сервиса"""
     response = client.get('/health')
@@ -97,6 +115,823 @@ def test_operation_schema_validation():
         print('Schemas module not available (skipping)')
 
 
+def test_operations_keyset_pagination():
+    """Тест курсорной пагинации списка операций"""
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    for i in range(5):
+        response = client.post('/operations', headers=headers, json={
+            'type': 'income', 'amount': 10.0 + i, 'description': f'Page {i}', 'branch_id': branch_id
+        })
+        assert response.status_code == 200
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        response = client.get('/operations', headers=headers, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page['items']) <= 2
+        seen.extend(op['id'] for op in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    full = client.get('/operations', headers=headers).json()
+    assert seen == [op['id'] for op in full]
+    assert len(seen) == 5
+
+
+def test_operations_invalid_cursor():
+    """Тест что поврежденный курсор отклоняется"""
+    response = client.get('/operations', headers=auth_headers(), params={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+
+
+def test_operations_ndjson_stream():
+    """Тест потоковой выдачи операций в NDJSON"""
+    import json
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    for i in range(3):
+        client.post('/operations', headers=headers, json={
+            'type': 'expense', 'amount': 5.0, 'description': f'Stream {i}', 'branch_id': branch_id
+        })
+
+    response = client.get('/operations', headers={**headers, 'Accept': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    streamed = [json.loads(line) for line in response.text.splitlines()]
+    assert streamed == client.get('/operations', headers=headers).json()
+
+
+def test_operations_batch_create():
+    """Тест пакетного создания операций с отчетом об ошибках по строкам"""
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    response = client.post('/operations/batch', headers=headers, json={'operations': [
+        {'type': 'income', 'amount': 100.0, 'description': 'Batch 0', 'branch_id': branch_id},
+        {'type': 'income', 'amount': 50.0, 'description': 'Чужой филиал',
+         'branch_id': branch_id + 1},
+        {'type': 'transfer', 'amount': 1.0, 'description': 'Неизвестный тип',
+         'branch_id': branch_id},
+        {'type': 'expense', 'amount': 30.0, 'description': 'Batch 3', 'branch_id': branch_id},
+    ]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data['inserted'] == 2
+    assert data['ids'][1] is None and data['ids'][2] is None
+    assert [error['index'] for error in data['errors']] == [1, 2]
+
+    operations = client.get('/operations', headers=headers).json()
+    by_id = {op['id']: op for op in operations}
+    assert by_id[data['ids'][0]]['description'] == 'Batch 0'
+    assert by_id[data['ids'][3]]['description'] == 'Batch 3'
+
+
+def test_operations_batch_forbidden_for_manager():
+    """Тест что руководитель не может загружать пакет операций"""
+    headers = auth_headers(role='manager', branch_id=0)
+    response = client.post('/operations/batch', headers=headers, json={
+        'operations': [{'type': 'income', 'amount': 1.0, 'description': 'x', 'branch_id': 1}]
+    })
+    assert response.status_code == 403
+
+
+def test_branch_balances_aggregation():
+    """Тест сводного баланса по нескольким филиалам"""
+    first, second = new_branch_id(), new_branch_id()
+    admin = auth_headers(role='system_admin', branch_id=0)
+    client.post('/operations/batch', headers=admin, json={'operations': [
+        {'type': 'income', 'amount': 100.0, 'description': 'a', 'branch_id': first},
+        {'type': 'expense', 'amount': 40.0, 'description': 'b', 'branch_id': first},
+        {'type': 'income', 'amount': 7.5, 'description': 'c', 'branch_id': second},
+    ]})
+
+    response = client.get('/balance/branches', headers=admin,
+                          params={'branch_ids': [first, second]})
+    assert response.status_code == 200
+    totals = {row['branch_id']: row for row in response.json()}
+    assert totals[first]['total_balance'] == 60.0 and totals[first]['count'] == 2
+    assert totals[second]['total_income'] == 7.5 and totals[second]['total_expense'] == 0.0
+
+    balance = client.get('/balance', headers=admin, params={'branch_id': first}).json()
+    assert balance['total_income'] == 100.0 and balance['total_expense'] == 40.0
+
+    # С фильтрами итоги считаются по операциям за период и тип, одним запросом на все филиалы
+    incomes = client.get('/balance/branches', headers=admin,
+                         params={'branch_ids': [first, second], 'type': 'income'}).json()
+    totals = {row['branch_id']: (row['total_income'], row['total_expense'], row['count'])
+              for row in incomes}
+    assert totals == {first: (100.0, 0.0, 1), second: (7.5, 0.0, 1)}
+    before = client.get('/balance/branches', headers=admin,
+                        params={'branch_ids': [first, second], 'date_to': '2000-01-01T00:00:00'})
+    assert before.status_code == 200 and before.json() == []
+
+    response = client.get('/balance/branches', headers=auth_headers(branch_id=first),
+                          params={'branch_ids': [second]})
+    assert response.status_code == 403
+
+
+def test_branch_ledger_verify_and_rebuild():
+    """Тест сверки и пересчета итогов филиалов"""
+    from app import ledger, models
+    from app.database import SessionLocal
+
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    client.post('/operations', headers=headers, json={
+        'type': 'income', 'amount': 25.0, 'description': 'Ledger', 'branch_id': branch_id
+    })
+
+    db = SessionLocal()
+    try:
+        drifted = {item['branch_id'] for item in ledger.verify(db)}
+        assert branch_id not in drifted
+
+        row = db.get(models.BranchBalance, branch_id)
+        row.total_income = 0.0
+        db.commit()
+        assert branch_id in {item['branch_id'] for item in ledger.verify(db)}
+
+        ledger.rebuild(db)
+        assert ledger.verify(db) == []
+    finally:
+        db.close()
+
+    balance = client.get('/balance', headers=headers).json()
+    assert balance['total_income'] == 25.0
+
+
+def test_conditional_get_with_etag():
+    """Тест ETag и ответа 304, пока данные филиала не менялись"""
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    operation = {'type': 'income', 'amount': 10.0, 'description': 'ETag', 'branch_id': branch_id}
+    client.post('/operations', headers=headers, json=operation)
+
+    for path in ('/operations', '/balance', '/balance/branches'):
+        first = client.get(path, headers=headers)
+        assert first.status_code == 200
+        tag = first.headers['etag']
+        assert first.headers['cache-control'] == 'private, no-cache'
+
+        cached = client.get(path, headers={**headers, 'If-None-Match': tag})
+        assert cached.status_code == 304
+        assert cached.content == b''
+
+    tag = client.get('/operations', headers=headers, params={'limit': 1}).headers['etag']
+    assert tag != client.get('/operations', headers=headers).headers['etag']
+
+    # Любая запись в филиал меняет версию данных и ETag
+    client.post('/operations', headers=headers, json=operation)
+    fresh = client.get('/operations', headers={**headers, 'If-None-Match': tag},
+                       params={'limit': 1})
+    assert fresh.status_code == 200
+    assert fresh.headers['etag'] != tag
+
+
+def test_operations_since_id():
+    """Тест догрузки операций после since_id"""
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    ids = [
+        client.post('/operations', headers=headers, json={
+            'type': 'income', 'amount': float(n), 'description': f'Since {n}',
+            'branch_id': branch_id
+        }).json()['id']
+        for n in range(3)
+    ]
+    response = client.get('/operations', headers=headers, params={'since_id': ids[0]})
+    assert response.status_code == 200
+    assert sorted(op['id'] for op in response.json()) == ids[1:]
+
+
+def test_feed_hub_filters_by_branch():
+    """Тест раздачи новых операций подписчикам ленты с учетом филиала"""
+    import asyncio
+    from datetime import datetime
+    from app import feed
+
+    async def scenario():
+        hub = feed.FeedHub()
+        own = hub.subscribe(7)
+        everything = hub.subscribe(None)
+        operations = [
+            {'id': 1, 'type': 'income', 'amount': 5.0, 'description': 'a', 'user_id': 1,
+             'branch_id': 7, 'created_at': datetime(2025, 1, 1)},
+            {'id': 2, 'type': 'expense', 'amount': 3.0, 'description': 'b', 'user_id': 1,
+             'branch_id': 8, 'created_at': datetime(2025, 1, 1)},
+        ]
+        hub.publish_operations(operations)
+        assert own.queue.qsize() == 1 and everything.queue.qsize() == 2
+        operation_id, frame = own.queue.get_nowait()
+        assert operation_id == 1
+        assert frame.startswith('id: 1\nevent: operation\ndata: {"id":1,')
+        assert frame.endswith('\n\n')
+
+        # Переполненная очередь закрывает поток подписчика
+        slow = hub.subscribe(None)
+        hub.publish_operations(operations * feed.SUBSCRIBER_QUEUE_SIZE)
+        assert slow not in hub.subscribers and slow.queue.get_nowait() is None
+        assert hub.stats()['dropped'] >= 1
+
+    asyncio.run(scenario())
+
+
+def test_operations_stream_requires_auth():
+    """Тест что лента операций требует токен"""
+    response = client.get('/operations/stream')
+    assert response.status_code == 401
+
+
+def test_stream_ticket_is_single_use():
+    """Тест билетов ленты: JWT в адресе не принимается, билет гасится при первом подключении"""
+    import asyncio
+    from datetime import timedelta
+    from app import stream_tickets
+    from app.database import AsyncSessionLocal
+
+    headers = auth_headers(branch_id=3, user_id=42)
+    token = headers['Authorization'].split()[1]
+    assert client.get('/operations/stream', params={'token': token}).status_code == 401
+    assert client.get('/operations/stream', params={'ticket': 'unknown'}).status_code == 401
+    assert client.post('/operations/stream/ticket').status_code in (401, 403)
+
+    response = client.post('/operations/stream/ticket', headers=headers)
+    assert response.status_code == 200
+    ticket = response.json()['ticket']
+    assert token not in ticket
+    assert response.json()['expires_in'] == stream_tickets.TTL.total_seconds()
+
+    async def redeem(value):
+        async with AsyncSessionLocal() as db:
+            return await stream_tickets.redeem(db, value)
+
+    async def expired_ticket():
+        async with AsyncSessionLocal() as db:
+            original = stream_tickets.TTL
+            stream_tickets.TTL = timedelta(seconds=-1)
+            try:
+                return await stream_tickets.issue(
+                    db, {'user_id': 42, 'role': 'accountant', 'branch_id': 3}
+                )
+            finally:
+                stream_tickets.TTL = original
+
+    assert asyncio.run(redeem(ticket)) == {'user_id': 42, 'role': 'accountant', 'branch_id': 3}
+    assert asyncio.run(redeem(ticket)) is None
+    assert asyncio.run(redeem(asyncio.run(expired_ticket()))) is None
+
+
+def test_stream_replay_overlap_and_reset(monkeypatch):
+    """Тест повтора ленты: поздно закоммиченный меньший id не теряется,
+    сверх лимита приходит reset"""
+    import asyncio
+    from datetime import datetime, timedelta
+    from app import feed, models
+    from app.main import _replay_operations
+    from app.database import AsyncSessionLocal
+
+    branch_id = new_branch_id()
+    user_data = {'user_id': 1, 'role': 'accountant', 'branch_id': branch_id}
+    now = datetime.utcnow()
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            old, late, delivered = (
+                models.Operation(type='income', amount=1, description=name, user_id=1,
+                                 branch_id=branch_id, created_at=created_at)
+                for name, created_at in (
+                    ('old', now - timedelta(hours=2)), ('late', now), ('delivered', now)
+                )
+            )
+            db.add_all([old, late, delivered])
+            await db.commit()
+            # late получил id раньше delivered, но клиент уже видел delivered
+            replayed = await _replay_operations(db, user_data, None, delivered.id)
+            return {operation.description for operation in replayed}
+
+    assert asyncio.run(scenario()) == {'late', 'delivered'}
+
+    monkeypatch.setattr(feed, 'REPLAY_LIMIT', 2)
+    response = client.get('/operations/stream', params={'since_id': 0},
+                          headers=auth_headers(branch_id=branch_id))
+    assert response.status_code == 200
+    assert response.text.endswith(feed.RESET_EVENT) and 'event: operation' not in response.text
+
+
+def test_create_operation_idempotency_key():
+    """Тест что повтор с тем же Idempotency-Key не создает вторую операцию"""
+    branch_id = new_branch_id()
+    headers = {**auth_headers(branch_id=branch_id), 'Idempotency-Key': str(uuid.uuid4())}
+    operation = {'type': 'income', 'amount': 12.5, 'description': 'Import', 'branch_id': branch_id}
+
+    first = client.post('/operations', headers=headers, json=operation)
+    assert first.status_code == 200
+    assert 'idempotent-replayed' not in first.headers
+
+    retry = client.post('/operations', headers=headers, json=operation)
+    assert retry.status_code == 200
+    assert retry.headers['idempotent-replayed'] == 'true'
+    assert retry.json() == first.json()
+
+    listed = client.get('/operations', headers=auth_headers(branch_id=branch_id)).json()
+    assert [op['id'] for op in listed] == [first.json()['id']]
+    balance = client.get('/balance', headers=auth_headers(branch_id=branch_id)).json()
+    assert balance['total_income'] == 12.5
+
+    changed = client.post('/operations', headers=headers, json={**operation, 'amount': 99.0})
+    assert changed.status_code == 422
+
+
+def test_group_commit_batches_concurrent_inserts():
+    """Тест группового commit: параллельные вставки одной транзакцией, у каждого своя строка"""
+    import asyncio
+    from app.database import AsyncSessionLocal
+    from app.group_commit import GroupCommitter
+
+    branch_id = new_branch_id()
+
+    async def scenario():
+        committer = GroupCommitter(AsyncSessionLocal, max_batch=10, max_wait_ms=50)
+        committer.start()
+        try:
+            rows = await asyncio.gather(*(
+                committer.submit({'type': 'income', 'amount': float(n), 'description': f'Group {n}',
+                                  'user_id': 1, 'branch_id': branch_id})
+                for n in range(5)
+            ))
+        finally:
+            await committer.stop()
+        return rows, committer.stats()
+
+    rows, stats = asyncio.run(scenario())
+    assert [row['amount'] for row in rows] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert len({row['id'] for row in rows}) == 5
+    assert stats['batches'] == 1 and stats['rows'] == 5
+
+    balance = client.get('/balance', headers=auth_headers(branch_id=branch_id)).json()
+    assert balance['total_income'] == 10.0
+
+
+def test_group_commit_isolates_failing_row_and_stop():
+    """Тест группового commit: ошибка строки достается только ее запросу,
+    stop отвечает пакету в работе"""
+    import asyncio
+    from app.database import AsyncSessionLocal
+    from app.group_commit import GroupCommitter
+
+    branch_id = new_branch_id()
+
+    def row(amount):
+        return {'type': 'income', 'amount': amount, 'description': 'Group', 'user_id': 1,
+                'branch_id': branch_id}
+
+    async def scenario():
+        committer = GroupCommitter(AsyncSessionLocal, max_batch=10, max_wait_ms=50)
+        committer.start()
+        try:
+            # amount NOT NULL: вторая строка ломает многострочный INSERT пакета
+            submitted = (committer.submit(row(amount)) for amount in (1.0, None, 2.0))
+            return await asyncio.gather(*submitted, return_exceptions=True), committer.stats()
+        finally:
+            await committer.stop()
+
+    results, stats = asyncio.run(scenario())
+    assert [result['amount'] for result in (results[0], results[2])] == [1.0, 2.0]
+    assert isinstance(results[1], Exception)
+    assert stats['retried_batches'] == 1
+    balance = client.get('/balance', headers=auth_headers(branch_id=branch_id)).json()
+    assert balance['total_income'] == 3.0
+
+    class StuckSession:
+        async def __aenter__(self):
+            await asyncio.Event().wait()
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+    async def stop_during_commit():
+        committer = GroupCommitter(StuckSession, max_batch=1, max_wait_ms=0)
+        committer.start()
+        pending = asyncio.ensure_future(committer.submit(row(5.0)))
+        await asyncio.sleep(0.05)
+        await committer.stop()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(pending, 1)
+
+    asyncio.run(stop_during_commit())
+
+
+def test_create_operation_rejects_unknown_type():
+    """Тест одиночной вставки: тип вне income/expense отклоняется до записи"""
+    branch_id = new_branch_id()
+    response = client.post('/operations', headers=auth_headers(branch_id=branch_id), json={
+        'type': 'transfer', 'amount': 1.0, 'description': 'Неизвестный тип', 'branch_id': branch_id
+    })
+    assert response.status_code == 400
+
+
+def test_operations_fields_projection():
+    """Тест выборки только запрошенных полей операций"""
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    for n in range(3):
+        client.post('/operations', headers=headers, json={
+            'type': 'expense', 'amount': float(n), 'description': 'Длинное описание ' * 20,
+            'branch_id': branch_id
+        })
+
+    response = client.get('/operations', headers=headers, params={'fields': 'amount,id'})
+    assert response.status_code == 200
+    assert [list(op) for op in response.json()] == [['id', 'amount']] * 3
+
+    # Курсор строится по created_at и id, даже если их нет в fields
+    page = client.get('/operations', headers=headers, params={'fields': 'type', 'limit': 2}).json()
+    assert page['items'] == [{'type': 'expense'}] * 2 and page['next_cursor']
+    rest = client.get('/operations', headers=headers,
+                      params={'fields': 'type', 'limit': 2, 'cursor': page['next_cursor']}).json()
+    assert rest == {'items': [{'type': 'expense'}], 'next_cursor': None}
+
+    response = client.get('/operations', headers=headers, params={'fields': 'id,password'})
+    assert response.status_code == 400
+
+
+def test_read_router_sticky_and_fallback():
+    """Тест выбора базы для чтения: реплика, основная после своей записи
+    и при недоступной реплике"""
+    import asyncio
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from app.database import AsyncSessionLocal
+    from app.read_replica import ReadRouter
+
+    replica = async_sessionmaker(create_async_engine('sqlite+aiosqlite://'))
+    broken = async_sessionmaker(
+        create_async_engine('sqlite+aiosqlite:////nonexistent/dir/replica.db')
+    )
+
+    async def opened(router, user_id):
+        db = await router.session(user_id)
+        await db.close()
+        return db
+
+    async def scenario():
+        router = ReadRouter(AsyncSessionLocal, replica, read_after_write=60)
+        assert (await opened(router, 1)).bind is replica.kw['bind']
+        router.mark_write(1)
+        assert (await opened(router, 1)).bind is AsyncSessionLocal.kw['bind']
+        assert (await opened(router, 2)).bind is replica.kw['bind']
+
+        failing = ReadRouter(AsyncSessionLocal, broken, retry_after=60)
+        assert (await opened(failing, 1)).bind is AsyncSessionLocal.kw['bind']
+        assert (await opened(failing, 1)).bind is AsyncSessionLocal.kw['bind']
+        return router.stats(), failing.stats()
+
+    stats, failing_stats = asyncio.run(scenario())
+    assert stats['replica_reads'] == 2 and stats['sticky_reads'] == 1
+    # Вторая попытка не ходит к реплике, пока не истек retry_after
+    assert failing_stats['fallbacks'] == 1 and failing_stats['primary_reads'] == 1
+    assert failing_stats['replica_down'] is True
+
+
+def test_operations_filters():
+    """Тест фильтров списка операций по периоду, типу, сумме и автору"""
+    from app import models
+    from app.database import SessionLocal
+    from datetime import datetime
+
+    branch_id = new_branch_id()
+    db = SessionLocal()
+    try:
+        for day, kind, amount, author in [(5, 'income', 100.0, 1), (10, 'expense', 40.0, 2),
+                                          (15, 'expense', 400.0, 2), (3, 'income', 7.0, 1)]:
+            month = 2 if day != 3 else 3
+            db.add(models.Operation(type=kind, amount=amount, description='filter', user_id=author,
+                                    branch_id=branch_id, created_at=datetime(2025, month, day)))
+        db.commit()
+    finally:
+        db.close()
+
+    headers = auth_headers(role='system_admin', branch_id=0)
+
+    def amounts(**params):
+        response = client.get('/operations', headers=headers,
+                              params={'branch_id': branch_id, **params})
+        assert response.status_code == 200
+        return sorted(op['amount'] for op in response.json())
+
+    february = {'date_from': '2025-02-01T00:00:00', 'date_to': '2025-03-01T00:00:00'}
+    assert amounts(**february) == [40.0, 100.0, 400.0]
+    assert amounts(**february, type='expense') == [40.0, 400.0]
+    assert amounts(min_amount=40, max_amount=100) == [40.0, 100.0]
+    assert amounts(user_id=1) == [7.0, 100.0]
+
+    response = client.get('/operations', headers=headers,
+                          params={'min_amount': 10, 'max_amount': 5})
+    assert response.status_code == 400
+    response = client.get('/operations', headers=headers, params={
+        'date_from': '2025-03-01T00:00:00', 'date_to': '2025-02-01T00:00:00'
+    })
+    assert response.status_code == 400
+
+
+def test_operations_search():
+    """Тест поиска операций по описанию с постраничной выдачей"""
+    from app.database import engine
+
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    for description in ('Зарплата за март', 'Аренда офиса', 'Зарплата за апрель', 'Премия'):
+        client.post('/operations', headers=headers, json={
+            'type': 'income', 'amount': 1.0, 'description': description, 'branch_id': branch_id
+        })
+
+    found = client.get('/operations', headers=headers, params={'q': 'Зарплата'}).json()
+    assert sorted(op['description'] for op in found) == ['Зарплата за апрель', 'Зарплата за март']
+
+    page = client.get('/operations', headers=headers, params={'q': 'Зарплата', 'limit': 1}).json()
+    assert len(page['items']) == 1 and page['next_cursor']
+    rest = client.get('/operations', headers=headers,
+                      params={'q': 'Зарплата', 'limit': 1, 'cursor': page['next_cursor']}).json()
+    assert len(rest['items']) == 1 and rest['next_cursor'] is None
+    assert {page['items'][0]['id'], rest['items'][0]['id']} == {op['id'] for op in found}
+
+    if engine.dialect.name == 'postgresql':
+        # Стемминг: другая форма слова находит те же операции
+        stemmed = client.get('/operations', headers=headers, params={'q': 'зарплаты'}).json()
+        assert len(stemmed) == 2
+    else:
+        # % и _ в запросе - обычные символы, а не шаблон LIKE
+        for description in ('Скидка 50%', 'Скидка 500', 'код_1', 'код11'):
+            client.post('/operations', headers=headers, json={
+                'type': 'income', 'amount': 1.0, 'description': description, 'branch_id': branch_id
+            })
+        def descriptions(q):
+            found = client.get('/operations', headers=headers, params={'q': q}).json()
+            return [op['description'] for op in found]
+
+        assert descriptions('50%') == ['Скидка 50%']
+        assert descriptions('код_') == ['код_1']
+        assert len(client.get('/operations', headers=headers, params={'q': '%'}).json()) == 1
+
+
+def test_archived_month_is_read_transparently(tmp_path, monkeypatch):
+    """Тест переноса месяца в архив: список, фильтры, ряд и баланс читают его как раньше"""
+    pytest.importorskip('pyarrow')
+    from datetime import date, datetime
+    from app import archive, ledger, models
+    from app.database import SessionLocal, engine
+
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', str(tmp_path))
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    old = [('income', 100.0, 'Аренда склада', datetime(2020, 1, 10, 9)),
+           ('expense', 40.0, 'Зарплата', datetime(2020, 1, 20, 9))]
+    db = SessionLocal()
+    try:
+        for kind, amount, description, created_at in old:
+            db.add(models.Operation(type=kind, amount=amount, description=description, user_id=1,
+                                    branch_id=branch_id, created_at=created_at))
+        ledger.record_operations(db, [(branch_id, kind, amount) for kind, amount, _d, _c in old])
+        db.commit()
+    finally:
+        db.close()
+    client.post('/operations', headers=headers, json={
+        'type': 'income', 'amount': 7.0, 'description': 'Текущая', 'branch_id': branch_id
+    })
+    listed = client.get('/operations', headers=headers).json()
+    balance = client.get('/balance', headers=headers).json()
+
+    with engine.connect() as connection:
+        manifests = archive.archive_month(connection, date(2020, 1, 1))
+    own = [(m['rows'], m['income'], m['expense']) for m in manifests if m['branch_id'] == branch_id]
+    assert own == [(2, 100.0, 40.0)]
+    assert archive.verify_files() == []
+
+    # Порции по одной строке: ответы собираются из нескольких кусков архива
+    monkeypatch.setattr(archive, 'READ_BATCH_ROWS', 1)
+    assert client.get('/operations', headers=headers).json() == listed
+    first = client.get('/operations', headers=headers, params={'limit': 2}).json()
+    assert [op['description'] for op in first['items']] == ['Текущая', 'Зарплата']
+    rest = client.get('/operations', headers=headers,
+                      params={'limit': 2, 'cursor': first['next_cursor']}).json()
+    assert [op['description'] for op in rest['items']] == ['Аренда склада']
+    assert rest['next_cursor'] is None
+    streamed = client.get('/operations', headers={**headers, 'Accept': 'application/x-ndjson'})
+    assert len(streamed.text.splitlines()) == 3
+
+    expenses = client.get('/operations', headers=headers,
+                          params={'type': 'expense', 'date_to': '2021-01-01T00:00:00'})
+    assert [op['amount'] for op in expenses.json()] == [40.0]
+    # Дата со смещением приводится к UTC: 2020-01-20T12:00+03:00 - это 09:00 UTC, операция не входит
+    aware = client.get('/operations', headers=headers,
+                       params={'date_to': '2020-01-20T12:00:00+03:00'})
+    assert [op['amount'] for op in aware.json()] == [100.0]
+    aware_series = client.get('/operations/timeseries', headers=headers,
+                              params={'interval': 'month', 'date_to': '2021-01-01T00:00:00Z'})
+    assert aware_series.json()[0]['count'] == 2
+    # Поиск идет только по таблице: диапазон, задевающий архив, отклоняется
+    searched = client.get('/operations', headers=headers, params={'q': 'склада'})
+    assert searched.status_code == 400 and '2020-02-01' in searched.json()['detail']
+    searched = client.get('/operations', headers=headers,
+                          params={'q': 'Текущая', 'date_from': '2020-02-01T00:00:00'})
+    assert [op['description'] for op in searched.json()] == ['Текущая']
+    monthly = client.get('/operations/timeseries', headers=headers,
+                         params={'interval': 'month'}).json()
+    first_month = monthly[0]
+    assert (first_month['bucket'], first_month['income'], first_month['expense'],
+            first_month['count']) == ('2020-01-01T00:00:00', 100.0, 40.0, 2)
+    weekly = client.get('/operations/timeseries', headers=headers,
+                        params={'interval': 'week'}).json()
+    assert [(point['bucket'], point['income'], point['expense']) for point in weekly[:2]] == [
+        ('2020-01-06T00:00:00', 100.0, 0.0), ('2020-01-20T00:00:00', 0.0, 40.0)
+    ]
+    assert client.get('/balance', headers=headers).json() == balance
+    archived = client.get('/balance/branches', headers=headers,
+                          params={'date_to': '2021-01-01T00:00:00'}).json()
+    assert [(row['total_income'], row['total_expense'], row['count'])
+            for row in archived] == [(100.0, 40.0, 2)]
+    incomes = client.get('/balance/branches', headers=headers, params={'type': 'income'}).json()
+    assert [(row['total_income'], row['count']) for row in incomes] == [(107.0, 2)]
+    db = SessionLocal()
+    try:
+        assert branch_id not in [item['branch_id'] for item in ledger.verify(db)]
+    finally:
+        db.close()
+
+
+def test_archive_publishes_month_staged_before_crash(tmp_path, monkeypatch):
+    """Тест архива: месяц, строки которого удалены до падения, публикуется при повторном запуске"""
+    pytest.importorskip('pyarrow')
+    from datetime import date, datetime
+    from app import archive, ledger, models
+    from app.database import SessionLocal, engine
+
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', str(tmp_path))
+    branch_id = new_branch_id()
+    headers = auth_headers(branch_id=branch_id)
+    db = SessionLocal()
+    try:
+        db.add(models.Operation(type='income', amount=25.0, description='До падения', user_id=1,
+                                branch_id=branch_id, created_at=datetime(2019, 3, 5, 9)))
+        ledger.record_operations(db, [(branch_id, 'income', 25.0)])
+        db.commit()
+    finally:
+        db.close()
+
+    replace = os.replace
+
+    def crash_on_publish(source, target):
+        # Манифесты пишутся как обычно, падает только переименование каталога месяца
+        if source.endswith(archive.PENDING_SUFFIX):
+            raise OSError('процесс упал до публикации')
+        replace(source, target)
+
+    with monkeypatch.context() as patched:
+        patched.setattr(archive.os, 'replace', crash_on_publish)
+        with engine.connect() as connection, pytest.raises(OSError):
+            archive.archive_month(connection, date(2019, 3, 1))
+    assert date(2019, 3, 1) not in archive.catalog()
+    assert client.get('/operations', headers=headers).json() == []
+
+    with engine.connect() as connection:
+        archive.archive_before(connection, date(2019, 4, 1))
+    assert branch_id in archive.catalog()[date(2019, 3, 1)]
+    listed = client.get('/operations', headers=headers).json()
+    assert [op['description'] for op in listed] == ['До падения']
+
+
+def test_token_cache_respects_expiry(monkeypatch):
+    """Тест кэша токенов: повтор берется из кэша, но не позже exp токена"""
+    import time
+
+    cache = auth_utils.TokenCache(max_size=2)
+    monkeypatch.setattr(auth_utils, 'token_cache', cache)
+    exp = int(time.time()) + 60
+    token = jwt.encode({'user_id': 5, 'role': 'accountant', 'branch_id': 1, 'exp': exp},
+                       auth_utils.SECRET_KEY, algorithm=auth_utils.ALGORITHM)
+
+    assert auth_utils.verify_token(token)['user_id'] == 5
+    assert auth_utils.verify_token(token)['user_id'] == 5
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # После exp запись из кэша не выдается, токен проверяется заново
+    real_time = time.time
+    monkeypatch.setattr(auth_utils.time, 'time', lambda: real_time() + 120)
+    auth_utils.verify_token(token)
+    assert cache.hits == 1 and cache.misses == 2
+    monkeypatch.setattr(auth_utils.time, 'time', real_time)
+
+    expired = jwt.encode({'user_id': 5, 'exp': int(time.time()) - 1},
+                         auth_utils.SECRET_KEY, algorithm=auth_utils.ALGORITHM)
+    assert auth_utils.verify_token(expired) is None
+    for user_id in (6, 7, 8):
+        auth_utils.verify_token(jwt.encode({'user_id': user_id}, auth_utils.SECRET_KEY,
+                                           algorithm=auth_utils.ALGORITHM))
+    assert cache.stats()['size'] == 2 and cache.evictions >= 1
+
+
+def test_fast_json_matches_pydantic_output():
+    """Тест что быстрая сериализация дает те же байты, что и OperationResponse"""
+    import json
+    from datetime import datetime
+    from typing import List
+    from pydantic import TypeAdapter
+    from app import fast_json, schemas
+
+    rows = [
+        (1, 'income', 12.5, 'Зарплата "аванс"\t\u0001', 3, 7, datetime(2025, 1, 6, 12, 30)),
+        (2, 'expense', 0.1, '', 3, 7, datetime(2025, 1, 6, 12, 30, 0, 4)),
+        (3, 'income', 1e16, 'Крупная', 3, 7, datetime(2025, 1, 6)),
+    ]
+    adapter = TypeAdapter(List[schemas.OperationResponse])
+
+    def reference(content):
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                          separators=(',', ':')).encode('utf-8')
+
+    for sample in (rows[:2], rows):
+        items = [dict(zip(fast_json.OPERATION_FIELDS, row)) for row in sample]
+        dumped = adapter.dump_python(adapter.validate_python(items), mode='json')
+        assert fast_json.encode_list(sample) == reference(dumped)
+        page = reference({'items': dumped, 'next_cursor': 'abc'})
+        assert fast_json.encode_page(sample, 'abc') == page
+        assert fast_json.encode_ndjson(sample) == b''.join(
+            schemas.OperationResponse.model_validate(item).model_dump_json().encode('utf-8') + b'\n'
+            for item in items
+        )
+
+
+def test_metrics_endpoint():
+    """Тест метрик пулов соединений синхронного и асинхронного движков"""
+    client.get('/balance', headers=auth_headers())
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    pools = response.json()['db_pool']
+    # read - пул реплики, если задан FINANCE_READ_DATABASE_URL
+    assert set(pools) - {'read'} == {'sync', 'async'}
+    assert 'replica_reads' in response.json()['read_routing']
+    for pool in pools.values():
+        if 'checkouts' in pool:
+            assert pool['checkout_timeouts'] >= 0
+            assert pool['checkout_wait_max_ms'] >= 0
+
+
+def test_operations_timeseries():
+    """Тест временного ряда по дням, неделям и месяцам"""
+    from app import models
+    from app.database import SessionLocal
+    from datetime import datetime
+
+    branch_id = new_branch_id()
+    db = SessionLocal()
+    try:
+        rows = [(6, 'income', 100.0), (6, 'expense', 30.0), (8, 'income', 50.0),
+                (20, 'income', 5.0)]
+        for day, kind, amount in rows:
+            db.add(models.Operation(type=kind, amount=amount, description='ts', user_id=1,
+                                    branch_id=branch_id, created_at=datetime(2025, 1, day, 12, 30)))
+        db.commit()
+    finally:
+        db.close()
+
+    headers = auth_headers(branch_id=branch_id)
+    params = {'date_from': '2025-01-01T00:00:00', 'date_to': '2025-02-01T00:00:00'}
+    daily = client.get('/operations/timeseries', headers=headers,
+                       params={**params, 'interval': 'day'}).json()
+    assert [(p['bucket'], p['income'], p['expense'], p['count']) for p in daily] == [
+        ('2025-01-06T00:00:00', 100.0, 30.0, 2),
+        ('2025-01-08T00:00:00', 50.0, 0.0, 1),
+        ('2025-01-20T00:00:00', 5.0, 0.0, 1),
+    ]
+    # 2025-01-06 и 2025-01-20 - понедельники
+    weekly = client.get('/operations/timeseries', headers=headers,
+                        params={**params, 'interval': 'week'}).json()
+    assert [(p['bucket'], p['count']) for p in weekly] == [
+        ('2025-01-06T00:00:00', 3), ('2025-01-20T00:00:00', 1)
+    ]
+    monthly = client.get('/operations/timeseries', headers=headers,
+                         params={**params, 'interval': 'month', 'type': 'income'}).json()
+    assert [(p['bucket'], p['income'], p['count']) for p in monthly] == [
+        ('2025-01-01T00:00:00', 155.0, 3)
+    ]
+
+    response = client.get('/operations/timeseries', headers=headers, params={'interval': 'hour'})
+    assert response.status_code == 422
+
+    # Бухгалтер: свой филиал в branch_ids разрешен, чужой - 403, как в /balance/branches
+    own = client.get('/operations/timeseries', headers=headers,
+                     params={**params, 'branch_ids': branch_id})
+    assert sum(p['count'] for p in own.json()) == 4
+    foreign = client.get('/operations/timeseries', headers=headers,
+                         params={**params, 'branch_ids': [branch_id, branch_id + 1]})
+    assert foreign.status_code == 403
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
 
@@ -4,6 +4,9 @@ class FinanceApp {
         this.currentUser = null;
         this.currentBranch = null;
         this.allOperations = [];
+        this.balance = null;
+        this.operationsStream = null;
+        this.lastEventId = null;
         this.currentOpsPage = 1;
         this.pageSize = 5;
         this.currentSort = 'date_desc';
@@ -16,6 +19,7 @@ class FinanceApp {
         
         await this.checkAuth();
         await this.loadDashboardData();
+        this.subscribeToOperations();
         this.setupRoleBasedUI();
         await this.loadUsersIfAdmin();
         this.setupEventListeners();
@@ -92,7 +96,80 @@ class FinanceApp {
     }
 }
 
+    // Новые операции приходят по SSE, список не перезагружается целиком.
+    // JWT в адрес не попадает: подключение открывается одноразовым билетом.
+    // Билет гасится при подключении, поэтому после обрыва берем новый и
+    // продолжаем с последнего полученного id (since_id).
+    async subscribeToOperations(sinceId = null) {
+        if (this.operationsStream) {
+            this.operationsStream.close();
+            this.operationsStream = null;
+        }
+        this.lastEventId = sinceId;
+        const token = localStorage.getItem('token');
+        let ticket;
+        try {
+            const response = await fetch('http://localhost:8001/operations/stream/ticket', {
+                method: 'POST',
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+            if (!response.ok) {
+                console.warn('Лента операций недоступна:', response.status);
+                return;
+            }
+            ticket = (await response.json()).ticket;
+        } catch (error) {
+            console.warn('Лента операций недоступна:', error);
+            setTimeout(() => this.subscribeToOperations(this.lastEventId), 3000);
+            return;
+        }
+        let streamUrl = `http://localhost:8001/operations/stream?ticket=${encodeURIComponent(ticket)}`;
+        if (this.currentBranch) {
+            streamUrl += `&branch_id=${this.currentBranch}`;
+        }
+        if (sinceId !== null) {
+            streamUrl += `&since_id=${sinceId}`;
+        }
+        const stream = new EventSource(streamUrl);
+        this.operationsStream = stream;
+        stream.addEventListener('operation', (event) => {
+            this.lastEventId = Number(event.lastEventId);
+            this.handleNewOperation(JSON.parse(event.data));
+        });
+        // Пропущено слишком много операций: сервер закрыл ленту, загружаем все заново
+        stream.addEventListener('reset', async () => {
+            stream.close();
+            if (this.operationsStream !== stream) return;
+            this.operationsStream = null;
+            await this.loadDashboardData();
+            this.subscribeToOperations();
+        });
+        stream.onerror = () => {
+            // Повтор с тем же адресом получит 401 (билет погашен): подключаемся заново сами
+            if (stream.readyState === EventSource.CLOSED && this.operationsStream === stream) {
+                setTimeout(() => this.subscribeToOperations(this.lastEventId), 3000);
+            }
+        };
+    }
+
+    handleNewOperation(operation) {
+        if (this.allOperations.some(op => op.id === operation.id)) return;
+        this.allOperations.unshift(operation);
+        if (this.balance) {
+            if (operation.type === 'income') {
+                this.balance.total_income += operation.amount;
+            } else {
+                this.balance.total_expense += operation.amount;
+            }
+            this.balance.total_balance = this.balance.total_income - this.balance.total_expense;
+            this.updateBalance(this.balance);
+        }
+        this.renderOperationsPage();
+        this.updatePaginationControls();
+    }
+
     updateBalance(balance) {
+        this.balance = balance;
         const formatCurrency = (amount) => {
             return new Intl.NumberFormat('ru-RU', {
                 style: 'currency',
@@ -646,9 +723,13 @@ class FinanceApp {
     async handleBranchFilter(e) {
         this.currentBranch = e.target.value ? parseInt(e.target.value) : null;
         await this.loadDashboardData();
+        this.subscribeToOperations();
     }
 
     handleLogout() {
+        if (this.operationsStream) {
+            this.operationsStream.close();
+        }
         localStorage.removeItem('token');
         localStorage.removeItem('user');
         window.location.href = 'index.html';
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query
 from fastapi.responses import JSONResponse, PlainTextResponse, Response
 import httpx
 from typing import Optional, List, Dict, Any
@@ -81,10 +81,25 @@ async def options_handler(path: str):
     )
 
 
-async def fetch_operations(authorization: Optional[str], branch_id: Optional[int]) -> List[Dict[str, Any]]:
-    params = {}
+# Поля операций, которые попадают в CSV и PDF (finance-service отдает только их)
+EXPORT_FIELDS = "id,type,amount,description,branch_id,created_at"
+
+
+def operation_filters(date_from: Optional[str], date_to: Optional[str],
+                      operation_type: Optional[str]) -> Dict[str, Any]:
+    """Фильтры отчета, которые finance-service применяет в SQL"""
+    filters = {"date_from": date_from, "date_to": date_to, "type": operation_type}
+    return {key: value for key, value in filters.items() if value}
+
+
+async def fetch_operations(authorization: Optional[str], branch_id: Optional[int],
+                           fields: Optional[str] = None,
+                           filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    params = dict(filters or {})
     if branch_id is not None:
         params["branch_id"] = branch_id
+    if fields:
+        params["fields"] = fields
     headers = {}
     if authorization:
         headers["Authorization"] = authorization
@@ -95,70 +110,105 @@ async def fetch_operations(authorization: Optional[str], branch_id: Optional[int
         return resp.json()
 
 
-def compute_summary(operations: List[Dict[str, Any]]) -> Dict[str, Any]:
-    total_income = 0.0
-    total_expense = 0.0
-    by_branch: Dict[int, Dict[str, float]] = {}
-
-    for op in operations:
-        amount = float(op.get("amount", 0) or 0)
-        branch = int(op.get("branch_id", 0) or 0)
-        kind = op.get("type", "")
-
-        if branch not in by_branch:
-            by_branch[branch] = {"income": 0.0, "expense": 0.0}
+async def fetch_branch_balances(authorization: Optional[str], branch_id: Optional[int],
+                                filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Итоги филиалов из /balance/branches; с filters (период, тип) - только за них"""
+    params = dict(filters or {})
+    # branch_id=0 означает все филиалы, как и в /operations
+    if branch_id:
+        params["branch_ids"] = branch_id
+    headers = {}
+    if authorization:
+        headers["Authorization"] = authorization
+    async with httpx.AsyncClient(timeout=10) as client:
+        resp = await client.get(f"{FINANCE_SERVICE_URL}/balance/branches",
+                                params=params, headers=headers)
+        if resp.status_code != 200:
+            raise HTTPException(status_code=resp.status_code, detail=resp.text)
+        return resp.json()
 
-        if kind == "income":
-            total_income += amount
-            by_branch[branch]["income"] += amount
-        elif kind == "expense":
-            total_expense += amount
-            by_branch[branch]["expense"] += amount
 
-    total_balance = total_income - total_expense
+async def fetch_recent_operations(authorization: Optional[str], branch_id: Optional[int],
+                                  limit: Optional[int], fields: Optional[str] = None,
+                                  filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Последние limit операций в порядке возрастания created_at.
+
+    Страницы finance-service (не больше 500 строк каждая) читаются по next_cursor,
+    пока не набрано limit строк. limit <= 0 - как раньше, срез [-limit:] всего списка.
+    """
+    if limit is None or int(limit) <= 0:
+        operations = await fetch_operations(authorization, branch_id, fields, filters)
+        operations = sorted(operations, key=lambda o: o.get("created_at", ""))
+        return operations if limit is None else operations[-int(limit):]
+    limit = int(limit)
+    params = dict(filters or {})
+    if branch_id is not None:
+        params["branch_id"] = branch_id
+    if fields:
+        params["fields"] = fields
+    headers = {}
+    if authorization:
+        headers["Authorization"] = authorization
+    collected: List[Dict[str, Any]] = []
+    async with httpx.AsyncClient(timeout=10) as client:
+        cursor = None
+        while len(collected) < limit:
+            page_params = {**params, "limit": limit - len(collected)}
+            if cursor:
+                page_params["cursor"] = cursor
+            resp = await client.get(f"{FINANCE_SERVICE_URL}/operations",
+                                    params=page_params, headers=headers)
+            if resp.status_code != 200:
+                raise HTTPException(status_code=resp.status_code, detail=resp.text)
+            page = resp.json()
+            collected.extend(page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+    return list(reversed(collected[:limit]))
+
+
+def summary_from_branches(branch_totals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сводка по итогам филиалов, посчитанным в finance-service"""
+    total_income = sum(b["total_income"] for b in branch_totals)
+    total_expense = sum(b["total_expense"] for b in branch_totals)
     branches = [
         {
-            "branch_id": b,
-            "income": round(vals["income"], 2),
-            "expense": round(vals["expense"], 2),
-            "balance": round(vals["income"] - vals["expense"], 2),
+            "branch_id": b["branch_id"],
+            "income": round(b["total_income"], 2),
+            "expense": round(b["total_expense"], 2),
+            "balance": round(b["total_income"] - b["total_expense"], 2),
         }
-        for b, vals in sorted(by_branch.items(), key=lambda x: x[0])
+        for b in sorted(branch_totals, key=lambda x: x["branch_id"])
     ]
-
     return {
         "total_income": round(total_income, 2),
         "total_expense": round(total_expense, 2),
-        "total_balance": round(total_balance, 2),
+        "total_balance": round(total_income - total_expense, 2),
         "branches": branches,
-        "count": len(operations),
+        "count": sum(b["count"] for b in branch_totals),
     }
 
 
 @app.get("/summary")
 async def summary(request: Request, branch_id: Optional[int] = None, limit: Optional[int] = 10):
     authorization = request.headers.get("Authorization")
-    operations = await fetch_operations(authorization, branch_id)
-    data = compute_summary(operations)
-    try:
-        ops_sorted = sorted(operations, key=lambda o: o.get("created_at", ""))
-        if limit is not None:
-            ops_sorted = ops_sorted[-int(limit):]
-    except Exception:
-        ops_sorted = operations
-    data["recent"] = ops_sorted
+    data = summary_from_branches(await fetch_branch_balances(authorization, branch_id))
+    data["recent"] = await fetch_recent_operations(authorization, branch_id, limit)
     return data
 
 
 @app.get("/export.csv")
-async def export_csv(request: Request, branch_id: Optional[int] = None, limit: Optional[int] = None):
+async def export_csv(request: Request, branch_id: Optional[int] = None, limit: Optional[int] = None,
+                     date_from: Optional[str] = None, date_to: Optional[str] = None,
+                     operation_type: Optional[str] = Query(None, alias="type")):
     authorization = request.headers.get("Authorization")
-    operations = await fetch_operations(authorization, branch_id)
-    if limit is not None:
-        try:
-            operations = sorted(operations, key=lambda o: o.get("created_at", ""))[-int(limit):]
-        except Exception:
-            pass
+    filters = operation_filters(date_from, date_to, operation_type)
+    if limit is None:
+        operations = await fetch_operations(authorization, branch_id, EXPORT_FIELDS, filters)
+    else:
+        operations = await fetch_recent_operations(authorization, branch_id, limit,
+                                                   EXPORT_FIELDS, filters)
 
     # CSV header
     rows = ["id,type,amount,description,branch_id,created_at"]
@@ -177,13 +227,18 @@ async def export_csv(request: Request, branch_id: Optional[int] = None, limit: O
 
 
 @app.get("/export.pdf")
-async def export_pdf(request: Request, branch_id: Optional[int] = None, limit: Optional[int] = 20):
+async def export_pdf(request: Request, branch_id: Optional[int] = None, limit: Optional[int] = 20,
+                     date_from: Optional[str] = None, date_to: Optional[str] = None,
+                     operation_type: Optional[str] = Query(None, alias="type")):
     if not REPORTLAB_AVAILABLE:
         raise HTTPException(status_code=500, detail="PDF engine not available. Install reportlab.")
 
     authorization = request.headers.get("Authorization")
-    operations = await fetch_operations(authorization, branch_id)
-    summary = compute_summary(operations)
+    filters = operation_filters(date_from, date_to, operation_type)
+    # Шапка и таблица филиалов - за тот же период и тип, что и список операций
+    summary = summary_from_branches(await fetch_branch_balances(authorization, branch_id, filters))
+    ops_sorted = await fetch_recent_operations(authorization, branch_id, limit,
+                                               EXPORT_FIELDS, filters)
 
     buffer = BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
@@ -200,6 +255,9 @@ async def export_pdf(request: Request, branch_id: Optional[int] = None, limit: O
     c.setFont(text_font, 10)
     c.drawString(25 * mm, height - 32 * mm, f"Всего операций: {summary['count']}")
     c.drawString(25 * mm, height - 37 * mm, f"Доход: {summary['total_income']} | Расход: {summary['total_expense']} | Баланс: {summary['total_balance']}")
+    if filters:
+        filter_text = ", ".join(f"{key}={value}" for key, value in filters.items())
+        c.drawString(25 * mm, height - 42 * mm, "Фильтры: " + filter_text)
 
     # Branch table
     y = height - 50 * mm
@@ -225,13 +283,6 @@ async def export_pdf(request: Request, branch_id: Optional[int] = None, limit: O
             y = height - 25 * mm
 
     # Recent operations table
-    try:
-        ops_sorted = sorted(operations, key=lambda o: o.get("created_at", ""))
-        if limit is not None:
-            ops_sorted = ops_sorted[-int(limit):]
-    except Exception:
-        ops_sorted = operations
-
     y -= 10 * mm
     if y < 40 * mm:
         c.showPage(); y = height - 25 * mm
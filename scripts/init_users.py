@@ -2,6 +2,9 @@
 """
 Script to initialize users in FinCloud system
 Usage: python init_users.py [auth-service-url]
+
+The first user (system_admin) is registered via /register; the rest are
+created with one admin POST /users/bulk call.
 """
 
 import sys
@@ -43,16 +46,57 @@ def register_user(user_data):
         print(f"❌ Error registering {email}: {e}")
         return False
 
+def login(user_data):
+    """Log in and return auth headers"""
+    response = requests.post(
+        f"{AUTH_URL}/login",
+        json={"email": user_data["email"], "password": user_data["password"]},
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def import_users(users, headers):
+    """Create users with a single POST /users/bulk; returns number processed"""
+    try:
+        response = requests.post(f"{AUTH_URL}/users/bulk", json={"users": users}, headers=headers)
+    except Exception as e:
+        print(f"❌ Error importing users: {e}")
+        return 0
+    if response.status_code == 404:
+        # Older auth-service without bulk import
+        print("⚠️  /users/bulk not available, registering one by one")
+        return sum(1 for user in users if register_user(user))
+    if response.status_code != 200:
+        print(f"❌ Bulk import failed (HTTP {response.status_code}): {response.text}")
+        return 0
+
+    body = response.json()
+    for result in body["results"]:
+        if result["status"] == "created":
+            print(f"✅ Successfully registered: {result['email']}")
+        else:
+            print(f"⚠️  {result['detail']}: {result['email']} (skipping)")
+    print(f"📦 Created {body['created']}, skipped {body['skipped']}")
+    return len(body["results"])
+
 def main():
     print("🔐 Initializing users in FinCloud...")
     print(f"📡 Auth Service URL: {AUTH_URL}")
     print()
     
+    admin, others = USERS[0], USERS[1:]
     success_count = 0
-    for user in USERS:
-        if register_user(user):
-            success_count += 1
-        print()
+    if register_user(admin):
+        success_count += 1
+    print()
+
+    try:
+        headers = login(admin)
+    except Exception as e:
+        print(f"❌ Cannot log in as {admin['email']}: {e}")
+        return
+    success_count += import_users(others, headers)
+    print()
     
     print("✅ User initialization complete!")
     print()